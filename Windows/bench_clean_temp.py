@@ -0,0 +1,368 @@
+"""
+Benchmark clean_temp against reproducible synthetic temp trees.
+
+Each case generates a fresh tree from a seed (depth, fan-out, files per
+directory, sizes, mtime spread, symlinks, read-only files), then runs
+clean_temp.clean_directory on it in a child process so peak RSS belongs
+to that run alone. Results are printed as JSON so runs can be compared
+across versions:
+
+    python bench_clean_temp.py --workers 1 4 --mode delete dry-run prune -o before.json
+
+Syscalls are counted in a separate instrumented pass on an identical tree,
+so the counting wrappers never skew the timings.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+HERE = Path(__file__).resolve().parent
+MODES = ("delete", "dry-run", "prune")
+
+
+def generate_tree(root: Path, args: argparse.Namespace) -> Dict[str, int]:
+    """Create the synthetic tree under root and return what was created."""
+    rng = random.Random(args.seed)
+    now = time.time()
+    cutoff = args.older_than_days * 86400
+    max_age = max(args.max_age_days * 86400, cutoff)
+    counts = {"files": 0, "dirs": 0, "symlinks": 0, "readonly": 0, "bytes": 0}
+    payload = b"x" * args.size_max
+
+    def random_age() -> float:
+        if rng.random() < args.old_fraction:
+            return rng.uniform(cutoff, max_age)
+        return rng.uniform(0, cutoff)
+
+    def populate(directory: Path, level: int) -> None:
+        directory.mkdir(parents=True, exist_ok=True)
+        for i in range(args.files_per_dir):
+            path = directory / f"f{i:05d}.tmp"
+            size = rng.randint(args.size_min, args.size_max)
+            with open(path, "wb") as fh:
+                fh.write(payload[:size])
+            age = random_age()
+            os.utime(path, (now - age, now - age))
+            if rng.random() < args.symlink_fraction:
+                try:
+                    os.symlink(path, directory / f"f{i:05d}.lnk")
+                    counts["symlinks"] += 1
+                except (OSError, NotImplementedError):
+                    # Creating symlinks needs a privilege on Windows.
+                    pass
+            if rng.random() < args.readonly_fraction:
+                os.chmod(path, stat.S_IREAD)
+                counts["readonly"] += 1
+            counts["files"] += 1
+            counts["bytes"] += size
+        if level < args.depth:
+            for i in range(args.fanout):
+                counts["dirs"] += 1
+                populate(directory / f"d{level}_{i}", level + 1)
+        if level > 1:
+            # Set last: creating children bumps the directory's mtime.
+            age = random_age()
+            os.utime(directory, (now - age, now - age))
+
+    populate(root, 1)
+    return counts
+
+
+def _count_calls(counters: Dict[str, int]) -> None:
+    """Wrap the os functions clean_temp uses so each call is counted."""
+    for name in ("scandir", "stat", "lstat", "unlink", "rmdir"):
+        original = getattr(os, name)
+
+        def wrapper(*a: Any, _name: str = name, _original: Any = original, **kw: Any) -> Any:
+            counters[_name] += 1
+            return _original(*a, **kw)
+
+        counters.setdefault(name, 0)
+        setattr(os, name, wrapper)
+
+    scandir = os.scandir
+    # DirEntry.stat() is a real lstat on POSIX the first time it is called;
+    # on Windows it is filled in from the directory listing for free.
+    stat_costs_syscall = os.name != "nt"
+    counters.setdefault("entry_stat", 0)
+
+    class CountingEntry:
+        __slots__ = ("_entry", "_statted")
+
+        def __init__(self, entry: os.DirEntry) -> None:
+            self._entry = entry
+            self._statted = False
+
+        def __getattr__(self, name: str) -> Any:
+            return getattr(self._entry, name)
+
+        def stat(self, *, follow_symlinks: bool = True) -> os.stat_result:
+            if stat_costs_syscall and not self._statted:
+                counters["entry_stat"] += 1
+                self._statted = True
+            return self._entry.stat(follow_symlinks=follow_symlinks)
+
+    class CountingScandir:
+        def __init__(self, path: Any) -> None:
+            self._it = scandir(path)
+
+        def __enter__(self) -> CountingScandir:
+            return self
+
+        def __exit__(self, *exc: Any) -> None:
+            self._it.close()
+
+        def __iter__(self) -> CountingScandir:
+            return self
+
+        def __next__(self) -> CountingEntry:
+            return CountingEntry(next(self._it))
+
+    os.scandir = CountingScandir  # type: ignore[assignment]
+
+
+def _peak_rss_bytes() -> int | None:
+    if os.name == "nt":
+        import ctypes
+        from ctypes import wintypes
+
+        class Counters(ctypes.Structure):
+            _fields_ = [
+                ("cb", wintypes.DWORD),
+                ("PageFaultCount", wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+
+        counters = Counters()
+        counters.cb = ctypes.sizeof(counters)
+        handle = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+            return None
+        return int(counters.PeakWorkingSetSize)
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_case(spec: Dict[str, Any]) -> Dict[str, Any]:
+    """Child side: clean one generated tree and measure it."""
+    counters: Dict[str, int] = {}
+    if spec["count_syscalls"]:
+        _count_calls(counters)
+    sys.path.insert(0, str(HERE))
+    import clean_temp
+
+    older = int(spec["older_than_days"] * 86400) or None
+    result = clean_temp.DeleteResult()
+    start = time.perf_counter()
+    clean_temp.clean_directory(
+        Path(spec["root"]),
+        spec["mode"] == "dry-run",
+        older,
+        result,
+        workers=spec["workers"],
+        prune=spec["mode"] == "prune",
+        echo=False,
+    )
+    elapsed = time.perf_counter() - start
+    return {
+        "seconds": elapsed,
+        "deleted_files": result.deleted_files,
+        "deleted_dirs": result.deleted_dirs,
+        "skipped": result.skipped,
+        "failures": result.failure_count,
+        "bytes_freed": result.bytes_freed,
+        "peak_rss_bytes": _peak_rss_bytes(),
+        "syscalls": counters,
+    }
+
+
+def _spawn(spec: Dict[str, Any]) -> Dict[str, Any]:
+    proc = subprocess.run(
+        [sys.executable, str(Path(__file__).resolve()), "--run-case", json.dumps(spec)],
+        check=True,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    return json.loads(proc.stdout)
+
+
+def _force_remove(func: Any, path: str, _exc: Any) -> None:
+    # Read-only files survive a failed run; clear the bit and retry.
+    os.chmod(path, stat.S_IWRITE | stat.S_IREAD)
+    func(path)
+
+
+def _fresh_tree(base: Path, args: argparse.Namespace) -> tuple[Path, Dict[str, int]]:
+    root = base / "tree"
+    if root.exists():
+        shutil.rmtree(root, onerror=_force_remove)
+    return root, generate_tree(root, args)
+
+
+def benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    results: List[Dict[str, Any]] = []
+    with tempfile.TemporaryDirectory(prefix="clean_temp_bench_", dir=args.base_dir) as tmp:
+        base = Path(tmp)
+        for mode in args.mode:
+            for workers in args.workers:
+                for repeat in range(args.repeat):
+                    spec = {
+                        "mode": mode,
+                        "workers": workers,
+                        "older_than_days": args.older_than_days,
+                        "count_syscalls": False,
+                    }
+                    root, counts = _fresh_tree(base, args)
+                    timed = _spawn(dict(spec, root=str(root)))
+                    entries = counts["files"] + counts["dirs"] + counts["symlinks"]
+                    row: Dict[str, Any] = {
+                        "mode": mode,
+                        "workers": workers,
+                        "repeat": repeat,
+                        "entries": entries,
+                        **{k: v for k, v in timed.items() if k != "syscalls"},
+                        "entries_per_sec": entries / timed["seconds"] if timed["seconds"] else None,
+                    }
+                    if not args.no_syscalls:
+                        root, _ = _fresh_tree(base, args)
+                        counted = _spawn(dict(spec, root=str(root), count_syscalls=True))
+                        total = sum(counted["syscalls"].values())
+                        row["syscalls"] = counted["syscalls"]
+                        row["syscalls_per_entry"] = total / entries if entries else None
+                    results.append(row)
+                    print(
+                        f"{mode:>8} workers={workers:<3} run={repeat} "
+                        f"{row['entries_per_sec'] or 0:,.0f} entries/s",
+                        file=sys.stderr,
+                    )
+    return {
+        "schema": 1,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "tree": {
+            "seed": args.seed,
+            "depth": args.depth,
+            "fanout": args.fanout,
+            "files_per_dir": args.files_per_dir,
+            "size_min": args.size_min,
+            "size_max": args.size_max,
+            "old_fraction": args.old_fraction,
+            "max_age_days": args.max_age_days,
+            "symlink_fraction": args.symlink_fraction,
+            "readonly_fraction": args.readonly_fraction,
+        },
+        "older_than_days": args.older_than_days,
+        "results": results,
+    }
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark clean_temp on synthetic temp trees.")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for the generated tree. Defaults to 1.")
+    parser.add_argument("--depth", type=int, default=3, help="Directory nesting depth. Defaults to 3.")
+    parser.add_argument("--fanout", type=int, default=8, help="Subdirectories per directory. Defaults to 8.")
+    parser.add_argument("--files-per-dir", type=int, default=50, help="Files per directory. Defaults to 50.")
+    parser.add_argument("--size-min", type=int, default=0, help="Smallest file size in bytes. Defaults to 0.")
+    parser.add_argument("--size-max", type=int, default=4096, help="Largest file size in bytes. Defaults to 4096.")
+    parser.add_argument(
+        "--old-fraction",
+        type=float,
+        default=0.7,
+        help="Share of files older than --older-than-days. Defaults to 0.7.",
+    )
+    parser.add_argument(
+        "--max-age-days",
+        type=float,
+        default=60,
+        help="Oldest file age in days; ages are spread uniformly. Defaults to 60.",
+    )
+    parser.add_argument(
+        "--symlink-fraction",
+        type=float,
+        default=0.01,
+        help="Share of files that also get a symlink pointing at them. Defaults to 0.01.",
+    )
+    parser.add_argument(
+        "--readonly-fraction",
+        type=float,
+        default=0.01,
+        help="Share of files marked read-only. Defaults to 0.01.",
+    )
+    parser.add_argument(
+        "--older-than-days",
+        type=float,
+        default=7,
+        help="Age cutoff passed to clean_temp. Defaults to 7.",
+    )
+    parser.add_argument(
+        "--mode",
+        nargs="+",
+        choices=MODES,
+        default=["delete", "dry-run"],
+        help="Modes to run. Defaults to delete and dry-run.",
+    )
+    parser.add_argument(
+        "--workers",
+        nargs="+",
+        type=int,
+        default=[1],
+        help="Worker counts to compare. Defaults to 1.",
+    )
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per case. Defaults to 1.")
+    parser.add_argument(
+        "--no-syscalls",
+        action="store_true",
+        help="Skip the instrumented pass that counts syscalls per entry.",
+    )
+    parser.add_argument("--base-dir", help="Where to generate trees. Defaults to the system temp folder.")
+    parser.add_argument("-o", "--output", help="Write the JSON results here instead of stdout.")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str]) -> int:
+    args = parse_args(argv)
+    if args.run_case:
+        print(json.dumps(run_case(json.loads(args.run_case))))
+        return 0
+    if args.size_min > args.size_max:
+        print("--size-min must not exceed --size-max.", file=sys.stderr)
+        return 1
+
+    report = benchmark(args)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
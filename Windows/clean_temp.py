@@ -3,19 +3,28 @@ Clean up common temp folders on Windows 10/11.
 
 By default this script empties the current user's temp directories and
 the system temp folder. It supports a dry-run mode and an age cutoff to
-avoid deleting very recent files.
+avoid deleting very recent files; with --prune the cutoff is applied to
+every file inside long-lived directories rather than to the top-level
+entry. Large trees can be cleaned with a pool of worker threads (--workers).
 """
 
 from __future__ import annotations
 
 import argparse
+import hashlib
+import heapq
+import json
 import os
-import shutil
+import re
+import sqlite3
+import stat
 import sys
 import time
-from dataclasses import dataclass
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Semaphore
 from pathlib import Path
-from typing import Iterable, List, Tuple
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Tuple, TypeVar
 
 
 # Conservative defaults: user temp folders plus the system temp folder.
@@ -26,80 +35,1144 @@ DEFAULT_TARGETS = (
     Path(os.environ.get("SystemRoot", r"C:\Windows")) / "Temp",
 )
 
+_REPARSE_POINT = getattr(stat, "FILE_ATTRIBUTE_REPARSE_POINT", 0x400)
+
+# Only the first few failures are kept verbatim; the rest are just counted.
+MAX_FAILURE_SAMPLE = 50
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class DeleteEvent(NamedTuple):
+    # kind is one of "deleted", "would-delete", "skipped", "failed".
+    kind: str
+    path: Path
+    is_dir: bool = False
+    message: str = ""
+    # Bytes freed (or that would be freed) by this event: logical size and
+    # allocated on-disk size. A failed directory carries what it freed first.
+    size: int = 0
+    allocated: int = 0
+
+
+EventSink = Callable[[DeleteEvent], None]
+
 
-@dataclass
 class DeleteResult:
-    deleted_files: int = 0
-    deleted_dirs: int = 0
-    failed: List[Tuple[Path, str]] | None = None
+    """Fixed-size run summary: counters plus a capped sample of failures."""
+
+    __slots__ = (
+        "deleted_files",
+        "deleted_dirs",
+        "skipped",
+        "bytes_freed",
+        "allocated_freed",
+        "failure_count",
+        "failed",
+        "max_failures",
+    )
+
+    def __init__(self, max_failures: int = MAX_FAILURE_SAMPLE) -> None:
+        self.deleted_files = 0
+        self.deleted_dirs = 0
+        self.skipped = 0
+        self.bytes_freed = 0
+        self.allocated_freed = 0
+        self.failure_count = 0
+        self.failed: List[Tuple[Path, str]] = []
+        self.max_failures = max_failures
 
     def log_failure(self, path: Path, message: str) -> None:
-        if self.failed is None:
-            self.failed = []
-        self.failed.append((path, message))
+        self.failure_count += 1
+        if len(self.failed) < self.max_failures:
+            self.failed.append((path, message))
+
+    def record(self, event: DeleteEvent) -> None:
+        self.bytes_freed += event.size
+        self.allocated_freed += event.allocated
+        if event.kind == "deleted":
+            if event.is_dir:
+                self.deleted_dirs += 1
+            else:
+                self.deleted_files += 1
+        elif event.kind == "skipped":
+            self.skipped += 1
+        elif event.kind == "failed":
+            self.log_failure(event.path, event.message)
+
+    def merge(self, other: DeleteResult) -> None:
+        self.deleted_files += other.deleted_files
+        self.deleted_dirs += other.deleted_dirs
+        self.skipped += other.skipped
+        self.bytes_freed += other.bytes_freed
+        self.allocated_freed += other.allocated_freed
+        self.failure_count += other.failure_count
+        room = self.max_failures - len(self.failed)
+        if room > 0:
+            self.failed.extend(other.failed[:room])
+
+
+class JsonlEventWriter:
+    """Event sink writing one JSON object per line as events arrive."""
+
+    def __init__(self, path: Path) -> None:
+        # Line buffered so the file can be tailed while a run is in progress.
+        self._fh = open(path, "w", encoding="utf-8", buffering=1)
+        # Targets are cleaned concurrently, each with its own emit lock.
+        self._lock = Lock()
+
+    def __call__(self, event: DeleteEvent) -> None:
+        record = {
+            "ts": round(time.time(), 3),
+            "event": event.kind,
+            "path": str(event.path),
+            "is_dir": event.is_dir,
+        }
+        if event.message:
+            record["message"] = event.message
+        if event.size or event.allocated:
+            record["size"] = event.size
+            record["allocated"] = event.allocated
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            self._fh.write(line)
+
+    def close(self) -> None:
+        self._fh.close()
+
+
+def allocated_bytes(st: os.stat_result) -> int:
+    # st_blocks is in 512-byte units; Windows has no equivalent field.
+    blocks = getattr(st, "st_blocks", None)
+    return blocks * 512 if blocks is not None else st.st_size
+
+
+class Tally:
+    """Running byte totals and oldest mtime for a set of files."""
+
+    __slots__ = ("size", "allocated", "oldest")
+
+    def __init__(self, size: int = 0, allocated: int = 0, oldest: float | None = None) -> None:
+        self.size = size
+        self.allocated = allocated
+        self.oldest = oldest
+
+    def add(self, st: os.stat_result) -> None:
+        self.size += st.st_size
+        self.allocated += allocated_bytes(st)
+        if self.oldest is None or st.st_mtime < self.oldest:
+            self.oldest = st.st_mtime
+
+    def merge(self, other: Tally) -> None:
+        self.size += other.size
+        self.allocated += other.allocated
+        if other.oldest is not None and (self.oldest is None or other.oldest < self.oldest):
+            self.oldest = other.oldest
+
+
+class HeaviestEntries:
+    """Keep the K heaviest top-level entries seen, using a bounded min-heap."""
+
+    def __init__(self, k: int) -> None:
+        self.k = k
+        self._heap: List[Tuple[int, int, str]] = []
+        self._lock = Lock()
+
+    def add(self, path: Path, tally: Tally) -> None:
+        if self.k <= 0 or not (tally.size or tally.allocated):
+            return
+        item = (tally.allocated, tally.size, str(path))
+        with self._lock:
+            if len(self._heap) < self.k:
+                heapq.heappush(self._heap, item)
+            elif item > self._heap[0]:
+                heapq.heapreplace(self._heap, item)
+
+    def ranked(self) -> List[Tuple[int, int, str]]:
+        with self._lock:
+            return sorted(self._heap, reverse=True)
+
+
+class ScanIndex:
+    """On-disk record of directories that --prune left in place.
+
+    Each row holds a directory's mtime after the run, the size of what was
+    kept below it and the mtime of its oldest kept file. A later run skips
+    the whole subtree when all of these hold:
+
+    * the directory's mtime is unchanged (nothing added, removed or renamed
+      directly inside it),
+    * the oldest kept file still cannot have crossed the age cutoff, and
+    * the row is younger than max_age_seconds. Changes deep inside a subtree
+      do not bump its ancestors' mtimes, so rows expire to force a periodic
+      full rescan.
+
+    Rows are dropped when a directory is removed or a failure happens below
+    it, and the whole index is discarded on a schema or rule change or with
+    --rebuild-index. Dry runs open the index read-only and treat one that
+    would be discarded as empty.
+    """
+
+    SCHEMA_VERSION = "1"
+    DIRS_TABLE = (
+        "CREATE TABLE IF NOT EXISTS dirs ("
+        "path TEXT PRIMARY KEY, mtime REAL, oldest REAL, size INTEGER, allocated INTEGER, scanned_at REAL)"
+    )
+
+    def __init__(
+        self, path: Path, max_age_seconds: float, rebuild: bool = False, rules: str = "", dry_run: bool = False
+    ) -> None:
+        self.max_age_seconds = max_age_seconds
+        self._lock = Lock()
+        self._pending = 0
+        # What was kept depends on the include/exclude rules, so a rule change
+        # invalidates everything just like a schema change.
+        stamp = f"{self.SCHEMA_VERSION}:{rules}"
+        if dry_run:
+            self._db = self._open_readonly(path, stamp, rebuild)
+            return
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        # It is only a cache: losing the tail of a run just means a rescan.
+        self._db.execute("PRAGMA synchronous=OFF")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'schema'").fetchone()
+        if rebuild or row is None or row[0] != stamp:
+            self._db.execute("DROP TABLE IF EXISTS dirs")
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('schema', ?)", (stamp,))
+        self._db.execute(self.DIRS_TABLE)
+        self._db.execute("DELETE FROM dirs WHERE scanned_at < ?", (time.time() - max_age_seconds,))
+        self._db.commit()
+
+    @classmethod
+    def _open_readonly(cls, path: Path, stamp: str, rebuild: bool) -> sqlite3.Connection:
+        """Open path without writing to it; an index that is missing or would
+        be discarded is replaced by an empty in-memory one. Expired rows are
+        left in place, lookup() already ignores them."""
+        if not rebuild and path.is_file():
+            db = sqlite3.connect(f"{path.resolve().as_uri()}?mode=ro", uri=True, check_same_thread=False)
+            try:
+                row = db.execute("SELECT value FROM meta WHERE key = 'schema'").fetchone()
+                if row is not None and row[0] == stamp:
+                    db.execute("SELECT 1 FROM dirs LIMIT 1").fetchall()
+                    return db
+            except sqlite3.OperationalError:
+                pass
+            db.close()
+        db = sqlite3.connect(":memory:", check_same_thread=False)
+        db.execute(cls.DIRS_TABLE)
+        return db
+
+    def lookup(self, path: str, mtime: float, older_than_seconds: int, now: float) -> Tally | None:
+        """Return the kept totals for path if its subtree can be skipped."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT mtime, oldest, size, allocated, scanned_at FROM dirs WHERE path = ?",
+                (os.path.abspath(path),),
+            ).fetchone()
+        if row is None:
+            return None
+        recorded_mtime, oldest, size, allocated, scanned_at = row
+        if recorded_mtime != mtime or now - scanned_at >= self.max_age_seconds:
+            return None
+        if now - oldest >= older_than_seconds:
+            return None
+        return Tally(size, allocated, oldest)
+
+    def store(self, path: str, mtime: float, kept: Tally, now: float) -> None:
+        oldest = kept.oldest if kept.oldest is not None else mtime
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?, ?, ?)",
+                (os.path.abspath(path), mtime, oldest, kept.size, kept.allocated, now),
+            )
+            self._tick()
+
+    def forget(self, path: str) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM dirs WHERE path = ?", (os.path.abspath(path),))
+            self._tick()
+
+    def _tick(self) -> None:
+        self._pending += 1
+        if self._pending >= 1000:
+            self._db.commit()
+            self._pending = 0
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+
+
+def _glob_to_regex(pattern: str) -> str:
+    """Translate one glob into a regex fragment over '/'-separated paths.
+
+    '*' and '?' stay within one component and '**' spans components. A
+    pattern without '/' matches the name at any depth; one with '/' is
+    anchored at the target. A trailing '/' restricts it to directories.
+    """
+    dir_only = pattern.endswith("/")
+    pattern = pattern.strip("/")
+    anchored = "/" in pattern
+    out = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            out.append(".*")
+            i += 2
+            continue
+        if c == "*":
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            end = pattern.find("]", i + 1)
+            if end < 0:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                out.append("[" + body.replace("\\", "\\\\") + "]")
+                i = end
+        else:
+            out.append(re.escape(c))
+        i += 1
+    body = "".join(out)
+    if not anchored:
+        body = "(?:.*/)?" + body
+    # Directories are matched with a trailing '/', files without one.
+    return body + ("/" if dir_only else "/?")
+
+
+def _has_magic(text: str) -> bool:
+    return "*" in text or "?" in text or "[" in text
+
+
+def _merge_only_dirs(current: bool | None, dir_only: bool) -> bool:
+    # Rule flags are None (no rule), True (directories only) or False (any
+    # entry); a rule for any entry subsumes a directory-only one.
+    return dir_only if current is None else current and dir_only
+
+
+def _allows(flag: bool | None, is_dir: bool) -> bool:
+    return flag is not None and (is_dir or not flag)
+
+
+class _GlobNode:
+    """Trie node for anchored globs, one component per level."""
+
+    __slots__ = ("children", "wild", "star", "is_star", "end", "under")
+
+    def __init__(self, is_star: bool = False) -> None:
+        self.children: dict = {}
+        # Wildcard components: glob text -> (compiled regex, child node).
+        self.wild: dict = {}
+        # '**/' continues in a node that can also swallow any component.
+        self.star: _GlobNode | None = None
+        self.is_star = is_star
+        # A rule ends here (end) or a trailing '**' covers everything below.
+        self.end: bool | None = None
+        self.under: bool | None = None
+
+
+class _GlobSet:
+    """One kind of rule, split by shape so a match costs about O(path length)
+    however many rules there are.
+
+    Name-only globs are checked against the basename: literal names by set
+    lookup, '*suffix' and 'prefix*' globs by dict lookup once per distinct
+    affix length, and only the remaining wildcard names by one regex over
+    the basename. Anchored globs live in a trie keyed by component, so only
+    wildcard components run a regex. Patterns with '**' inside a component
+    fall back to a full-path regex.
+    """
+
+    def __init__(self, patterns: List[str]) -> None:
+        # NTFS names are case-insensitive.
+        self.fold = os.name == "nt"
+        self.names: dict = {}
+        self.suffixes: dict = {}
+        self.prefixes: dict = {}
+        self.root = _GlobNode()
+        self.anchored = False
+        name_globs: dict = {False: [], True: []}
+        full_globs: List[str] = []
+        for pattern in patterns:
+            if self.fold:
+                pattern = pattern.lower()
+            dir_only = pattern.endswith("/")
+            body = pattern.strip("/")
+            if not body:
+                continue
+            if "/" not in body and "**" not in body:
+                if not _has_magic(body):
+                    self.names[body] = _merge_only_dirs(self.names.get(body), dir_only)
+                elif body[0] == "*" and not _has_magic(body[1:]):
+                    self.suffixes[body[1:]] = _merge_only_dirs(self.suffixes.get(body[1:]), dir_only)
+                elif body[-1] == "*" and not _has_magic(body[:-1]):
+                    self.prefixes[body[:-1]] = _merge_only_dirs(self.prefixes.get(body[:-1]), dir_only)
+                else:
+                    name_globs[dir_only].append(_glob_to_regex(body))
+            elif "/" in body and all(part == "**" or "**" not in part for part in body.split("/")):
+                self._insert(body.split("/"), dir_only)
+            else:
+                full_globs.append(pattern)
+        self.suffix_lengths = sorted({len(k) for k in self.suffixes})
+        self.prefix_lengths = sorted({len(k) for k in self.prefixes})
+        self.name_any = re.compile("|".join(name_globs[False])) if name_globs[False] else None
+        self.name_dir = re.compile("|".join(name_globs[True])) if name_globs[True] else None
+        self.full = re.compile("|".join(_glob_to_regex(p) for p in full_globs)) if full_globs else None
+
+    def _insert(self, parts: List[str], dir_only: bool) -> None:
+        self.anchored = True
+        node = self.root
+        for i, part in enumerate(parts):
+            if part == "**":
+                if i == len(parts) - 1:
+                    node.under = _merge_only_dirs(node.under, dir_only)
+                    return
+                if node.star is None:
+                    node.star = _GlobNode(is_star=True)
+                node = node.star
+            elif _has_magic(part):
+                if part not in node.wild:
+                    node.wild[part] = (re.compile(_glob_to_regex(part)), _GlobNode())
+                node = node.wild[part][1]
+            else:
+                node = node.children.setdefault(part, _GlobNode())
+        node.end = _merge_only_dirs(node.end, dir_only)
+
+    def match(self, rel: str, is_dir: bool) -> bool:
+        if self.fold:
+            rel = rel.lower()
+        name = rel.rpartition("/")[2]
+        if _allows(self.names.get(name), is_dir):
+            return True
+        size = len(name)
+        for length in self.suffix_lengths:
+            if length > size:
+                break
+            if _allows(self.suffixes.get(name[size - length:]), is_dir):
+                return True
+        for length in self.prefix_lengths:
+            if length > size:
+                break
+            if _allows(self.prefixes.get(name[:length]), is_dir):
+                return True
+        if self.name_any is not None and self.name_any.fullmatch(name):
+            return True
+        if is_dir and self.name_dir is not None and self.name_dir.fullmatch(name):
+            return True
+        if self.anchored and self._match_trie(rel.split("/"), is_dir):
+            return True
+        # Directories are matched with a trailing '/', files without one.
+        return self.full is not None and self.full.fullmatch(rel + "/" if is_dir else rel) is not None
+
+    @staticmethod
+    def _closure(nodes: Iterable[_GlobNode]) -> List[_GlobNode]:
+        out: List[_GlobNode] = []
+        seen = set()
+        for node in nodes:
+            while node is not None and id(node) not in seen:
+                seen.add(id(node))
+                out.append(node)
+                node = node.star
+        return out
+
+    def _match_trie(self, parts: List[str], is_dir: bool) -> bool:
+        states = self._closure([self.root])
+        for part in parts:
+            step: List[_GlobNode] = []
+            for node in states:
+                # A trailing '**' matches anything below its directory.
+                if _allows(node.under, is_dir):
+                    return True
+                child = node.children.get(part)
+                if child is not None:
+                    step.append(child)
+                for regex, child in node.wild.values():
+                    if regex.fullmatch(part):
+                        step.append(child)
+                if node.is_star:
+                    step.append(node)
+            states = self._closure(step)
+            if not states:
+                return False
+        for node in states:
+            if _allows(node.end, is_dir):
+                return True
+            if is_dir:
+                # As in the full-path form, a directory also matches a rule
+                # (not a directory-only one) whose last component can be
+                # empty: 'cache/*' and 'cache/**' cover 'cache' itself.
+                if node.under is False:
+                    return True
+                for regex, child in node.wild.values():
+                    if child.end is False and regex.fullmatch(""):
+                        return True
+        return False
+
+
+class RuleSet:
+    """Include/exclude globs, each kind compiled into a _GlobSet.
+
+    Paths are relative to the target and use '/'. Exclude beats include: an
+    excluded entry is never touched and an excluded directory is not even
+    descended. When include rules exist, only files matching one (or lying
+    under an included directory) are deleted.
+    """
+
+    def __init__(self, include: Iterable[str] = (), exclude: Iterable[str] = ()) -> None:
+        self.include = [p.replace("\\", "/") for p in include if p.strip()]
+        self.exclude = [p.replace("\\", "/") for p in exclude if p.strip()]
+        self._include = _GlobSet(self.include) if self.include else None
+        self._exclude = _GlobSet(self.exclude) if self.exclude else None
+
+    @classmethod
+    def from_file(cls, path: Path, include: Iterable[str] = (), exclude: Iterable[str] = ()) -> RuleSet:
+        """Read '+ glob' (include) and '- glob' (exclude) lines; '#' starts a comment."""
+        include = list(include)
+        exclude = list(exclude)
+        with open(path, encoding="utf-8") as fh:
+            for lineno, line in enumerate(fh, 1):
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                if line[:2] == "+ ":
+                    include.append(line[2:].strip())
+                elif line[:2] == "- ":
+                    exclude.append(line[2:].strip())
+                else:
+                    raise ValueError(f"{path}:{lineno}: expected '+ <glob>' or '- <glob>'")
+        return cls(include, exclude)
+
+    def __bool__(self) -> bool:
+        return bool(self.include or self.exclude)
+
+    def fingerprint(self) -> str:
+        text = "\0".join(["+" + p for p in self.include] + ["-" + p for p in self.exclude])
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def excluded(self, rel: str, is_dir: bool) -> bool:
+        return self._exclude is not None and self._exclude.match(rel, is_dir)
+
+    def included(self, rel: str, is_dir: bool) -> bool:
+        return self._include is None or self._include.match(rel, is_dir)
+
+
+class _TokenBucket:
+    """Thread-safe token bucket; callers that overdraw sleep off their debt."""
+
+    def __init__(self, rate: float) -> None:
+        self.rate = rate
+        self.capacity = max(rate, 1.0)
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+        self._lock = Lock()
+
+    def take(self, amount: float) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class Deleter:
+    """Removal backend: per-directory batches, bounded I/O depth, throttling.
+
+    max_inflight caps the removals in flight across every worker and target;
+    each directory's batch is split over up to that many threads, so slow or
+    network-backed disks see several removals in flight even for small
+    directories. 0 leaves each caller removing its own files, uncapped.
+    max_iops (operations/sec) and max_bytes_per_sec cap the pace across all
+    callers for runs that must stay out of the way of production I/O.
+    0 = unlimited.
+    """
+
+    CHUNK_SIZE = 16
+
+    def __init__(self, max_inflight: int = 0, max_iops: float = 0, max_bytes_per_sec: float = 0) -> None:
+        self.max_inflight = max(0, max_inflight)
+        self._iops = _TokenBucket(max_iops) if max_iops > 0 else None
+        self._bytes = _TokenBucket(max_bytes_per_sec) if max_bytes_per_sec > 0 else None
+        self._slots = Semaphore(self.max_inflight) if self.max_inflight > 0 else None
+        self._pool = ThreadPoolExecutor(max_workers=self.max_inflight) if self.max_inflight > 1 else None
+
+    def _throttle(self, ops: int, nbytes: int) -> None:
+        if self._iops is not None:
+            self._iops.take(ops)
+        if self._bytes is not None and nbytes:
+            self._bytes.take(nbytes)
+
+    @staticmethod
+    def _unlink_each(chunk: List[Tuple[str, int]]) -> List[OSError | None]:
+        errors: List[OSError | None] = []
+        for path, _ in chunk:
+            try:
+                os.unlink(path)
+                errors.append(None)
+            except OSError as exc:
+                errors.append(exc)
+        return errors
+
+    def _unlink_chunk(self, chunk: List[Tuple[str, int]]) -> List[OSError | None]:
+        # Throttle before taking a slot so a sleeping caller holds none.
+        self._throttle(len(chunk), sum(size for _, size in chunk))
+        if self._slots is None:
+            return self._unlink_each(chunk)
+        with self._slots:
+            return self._unlink_each(chunk)
+
+    def unlink_many(self, items: List[Tuple[str, int]]) -> List[OSError | None]:
+        """Unlink (path, size) items; returns the error for each, or None."""
+        size = self.CHUNK_SIZE
+        if self._pool is not None:
+            # Spread even a small directory over every slot.
+            size = max(1, min(size, -(-len(items) // self.max_inflight)))
+        chunks = [items[i:i + size] for i in range(0, len(items), size)]
+        if self._pool is None or len(chunks) <= 1:
+            results = map(self._unlink_chunk, chunks)
+        else:
+            results = self._pool.map(self._unlink_chunk, chunks)
+        return [error for chunk_errors in results for error in chunk_errors]
+
+    def rmdir(self, path: str) -> None:
+        self._throttle(1, 0)
+        if self._slots is None:
+            os.rmdir(path)
+            return
+        with self._slots:
+            os.rmdir(path)
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown()
+
+
+# Unthrottled backend for callers that do not configure one.
+_DIRECT = Deleter()
+
+
+def _top_level_tasks(entries: Iterable[os.DirEntry], size: int) -> Iterator[List[os.DirEntry]]:
+    """Group top-level entries into worker tasks: every directory (or link)
+    is a task of its own so subtrees spread across the pool, while plain
+    files are batched, size at a time, to amortise per-task overhead."""
+    files: List[os.DirEntry] = []
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield [entry]
+            continue
+        files.append(entry)
+        if len(files) >= size:
+            yield files
+            files = []
+    if files:
+        yield files
 
 
-def iter_targets(custom_paths: Iterable[str] | None) -> List[Path]:
+def iter_targets(
+    custom_paths: Iterable[str] | None,
+    dropped: List[Tuple[Path, Path]] | None = None,
+) -> List[Path]:
     if custom_paths:
-        return [Path(p).expanduser() for p in custom_paths]
-    # Filter out empty env vars while keeping order.
-    return [p for p in DEFAULT_TARGETS if str(p).strip()]
+        paths = [Path(p).expanduser() for p in custom_paths]
+    else:
+        # Filter out empty env vars while keeping order.
+        paths = [p for p in DEFAULT_TARGETS if str(p).strip()]
+    return dedupe_targets(paths, dropped)
 
 
-def is_recent(path: Path, older_than_seconds: int | None, now: float) -> bool:
+def _identity(path: Path, cache: dict) -> object:
+    key = str(path)
+    if key not in cache:
+        try:
+            st = os.stat(path)
+            cache[key] = (st.st_dev, st.st_ino)
+        except OSError:
+            # Fall back to the spelling for paths that cannot be statted.
+            cache[key] = os.path.normcase(key)
+    return cache[key]
+
+
+def dedupe_targets(
+    paths: Iterable[Path],
+    dropped: List[Tuple[Path, Path]] | None = None,
+) -> List[Path]:
+    """Resolve targets and drop aliases and nested duplicates.
+
+    Two targets are the same when they resolve to the same (st_dev, st_ino),
+    which catches TEMP and TMP both pointing at LOCALAPPDATA\\Temp as well as
+    case, 8.3 and junction spellings. A target inside another target is
+    collapsed into its outermost ancestor. Each removed target is appended
+    to dropped as (target as the caller spelled it, kept_target); a target
+    repeated with the same spelling is dropped silently. Order is otherwise
+    preserved.
+    """
+    cache: dict = {}
+    given: List[Path] = []
+    resolved: List[Path] = []
+    for path in paths:
+        given.append(path)
+        try:
+            path = path.resolve()
+        except OSError:
+            pass
+        resolved.append(path)
+    owners = {}
+    for path in resolved:
+        owners.setdefault(_identity(path, cache), path)
+
+    kept: List[Path] = []
+    seen = set()
+    spellings = set()
+    for original, path in zip(given, resolved):
+        spelling = os.path.normcase(str(original))
+        report = dropped is not None and spelling not in spellings
+        spellings.add(spelling)
+        ident = _identity(path, cache)
+        owner = owners[ident]
+        if ident in seen:
+            if report:
+                dropped.append((original, owner))
+            continue
+        # Any ancestor that is itself a target covers this one; the loop
+        # ends on the outermost, which is the one that gets cleaned.
+        ancestor = None
+        for parent in path.parents:
+            parent_ident = _identity(parent, cache)
+            if parent_ident in owners and parent_ident != ident:
+                ancestor = owners[parent_ident]
+        if ancestor is not None:
+            seen.add(ident)
+            if report:
+                dropped.append((original, ancestor))
+            continue
+        seen.add(ident)
+        kept.append(owner)
+    return kept
+
+
+def _is_tree_dir(entry: os.DirEntry) -> bool:
+    """True for real directories; symlinks and junctions are never descended."""
+    if not entry.is_dir(follow_symlinks=False):
+        return False
+    if os.name != "nt":
+        return True
+    # On Windows scandir already filled in the attributes, so this is free.
+    st = entry.stat(follow_symlinks=False)
+    return not (getattr(st, "st_file_attributes", 0) & _REPARSE_POINT)
+
+
+def _remove_tree(path: str, tally: Tally | None = None, dry_run: bool = False, deleter: Deleter = _DIRECT) -> None:
+    """Delete a directory bottom-up using the type data cached by scandir.
+
+    Unlike rmtree this keeps going past a locked file so the rest of the
+    subtree is still reclaimed; the first error is raised at the end. Files
+    are handed to the deleter in one batch per directory and their sizes
+    added to tally; with dry_run the tree is only measured.
+    """
+    first_error: OSError | None = None
+    with os.scandir(path) as it:
+        entries = list(it)
+    doomed: List[Tuple[str, os.stat_result]] = []
+    for entry in entries:
+        try:
+            if _is_tree_dir(entry):
+                _remove_tree(entry.path, tally, dry_run, deleter)
+            else:
+                doomed.append((entry.path, entry.stat(follow_symlinks=False)))
+        except FileNotFoundError:
+            pass
+        except OSError as exc:
+            if first_error is None:
+                first_error = exc
+    if dry_run:
+        errors: List[OSError | None] = [None] * len(doomed)
+    else:
+        errors = deleter.unlink_many([(p, st.st_size) for p, st in doomed])
+    for (_, st), error in zip(doomed, errors):
+        if error is None:
+            if tally is not None:
+                tally.add(st)
+        elif first_error is None and not isinstance(error, FileNotFoundError):
+            first_error = error
+    if first_error is not None:
+        raise first_error
+    if not dry_run:
+        deleter.rmdir(path)
+
+
+def _entry_is_recent(entry: os.DirEntry, older_than_seconds: int | None, now: float) -> bool:
     if older_than_seconds is None:
         return False
     try:
-        mtime = path.stat().st_mtime
+        return (now - entry.stat(follow_symlinks=False).st_mtime) < older_than_seconds
     except OSError:
         return False
-    return (now - mtime) < older_than_seconds
 
 
-def delete_path(path: Path, dry_run: bool, older_than_seconds: int | None, now: float, result: DeleteResult) -> None:
-    # Skip symlinks to avoid following unexpected targets.
-    if path.is_symlink():
-        return
-    if is_recent(path, older_than_seconds, now):
-        return
-    try:
-        if dry_run:
-            print(f"[DRY-RUN] Would delete: {path}")
+def _failure_event(path: Path, exc: OSError, is_dir: bool = False) -> DeleteEvent:
+    if isinstance(exc, PermissionError):
+        return DeleteEvent("failed", path, is_dir, f"Permission denied: {exc}")
+    return DeleteEvent("failed", path, is_dir, f"Failed: {exc}")
+
+
+class _Walker:
+    """Per-target walk settings shared by the worker threads."""
+
+    def __init__(
+        self,
+        dry_run: bool,
+        older_than_seconds: int | None,
+        now: float,
+        emit: EventSink,
+        prune: bool = False,
+        index: ScanIndex | None = None,
+        deleter: Deleter = _DIRECT,
+        rules: RuleSet | None = None,
+    ) -> None:
+        self.dry_run = dry_run
+        self.older_than_seconds = older_than_seconds
+        self.now = now
+        self.emit = emit
+        self.prune = prune
+        self.deleter = deleter
+        self.rules = rules if rules else None
+        # Without a cutoff everything goes, so there is nothing to skip.
+        self.index = index if older_than_seconds is not None else None
+
+    def clean_entries(self, entries: List[os.DirEntry]) -> List[Tuple[str, Tally]]:
+        """Clean a slice of top-level entries and return the bytes each freed
+        (or would free). Plain files are unlinked together in one batch."""
+        # Links are never followed and age comes from the DirEntry cache.
+        results: List[Tuple[str, Tally]] = []
+        files: List[Tuple[os.DirEntry, os.stat_result, Tally]] = []
+        for entry in entries:
+            path = Path(entry.path)
+            tally = Tally()
+            results.append((entry.path, tally))
+            is_dir = _is_tree_dir(entry)
+            if entry.is_symlink() or (entry.is_dir(follow_symlinks=False) and not is_dir):
+                self.emit(DeleteEvent("skipped", path, False, "link"))
+                continue
+            included = True
+            if self.rules is not None:
+                if self.rules.excluded(entry.name, is_dir):
+                    self.emit(DeleteEvent("skipped", path, is_dir, "excluded"))
+                    continue
+                included = self.rules.included(entry.name, is_dir)
+                if not is_dir and not included:
+                    self.emit(DeleteEvent("skipped", path, False, "not included"))
+                    continue
+            try:
+                if self.prune and is_dir:
+                    # Age is judged per file inside, not by the directory's
+                    # own mtime. Each file emits its own sized event.
+                    self.prune_tree(entry, tally, entry.name, included)
+                    continue
+                if _entry_is_recent(entry, self.older_than_seconds, self.now):
+                    self.emit(DeleteEvent("skipped", path, is_dir, "recent"))
+                    continue
+                if not is_dir:
+                    files.append((entry, entry.stat(follow_symlinks=False), tally))
+                    continue
+                if self.rules is not None:
+                    # Rules may protect entries deep inside, so the tree is
+                    # walked entry by entry; its age was judged above.
+                    self.prune_tree(entry, tally, entry.name, included, by_age=False)
+                    continue
+                _remove_tree(entry.path, tally, self.dry_run, self.deleter)
+                kind = "would-delete" if self.dry_run else "deleted"
+                self.emit(DeleteEvent(kind, path, True, size=tally.size, allocated=tally.allocated))
+            except FileNotFoundError:
+                pass
+            except OSError as exc:
+                failure = _failure_event(path, exc, is_dir)
+                self.emit(failure._replace(size=tally.size, allocated=tally.allocated))
+        self._unlink_files(files)
+        return results
+
+    def _unlink_files(self, files: List[Tuple[os.DirEntry, os.stat_result, Tally]]) -> None:
+        if not files:
             return
-        if path.is_dir():
-            shutil.rmtree(path, ignore_errors=False)
-            result.deleted_dirs += 1
+        if self.dry_run:
+            errors: List[OSError | None] = [None] * len(files)
         else:
-            path.unlink()
-            result.deleted_files += 1
-    except FileNotFoundError:
-        pass
-    except PermissionError as exc:
-        result.log_failure(path, f"Permission denied: {exc}")
-    except OSError as exc:
-        result.log_failure(path, f"Failed: {exc}")
+            errors = self.deleter.unlink_many([(entry.path, st.st_size) for entry, st, _ in files])
+        kind = "would-delete" if self.dry_run else "deleted"
+        for (entry, st, tally), error in zip(files, errors):
+            if error is None:
+                tally.add(st)
+                self.emit(DeleteEvent(kind, Path(entry.path), size=st.st_size, allocated=allocated_bytes(st)))
+            elif not isinstance(error, FileNotFoundError):
+                self.emit(_failure_event(Path(entry.path), error))
+
+    def prune_tree(
+        self,
+        entry: os.DirEntry,
+        freed: Tally,
+        rel: str = "",
+        included: bool = True,
+        by_age: bool = True,
+    ) -> Tuple[Tally | None, bool]:
+        """Apply the age cutoff to every file below entry, removing
+        directories bottom-up once they are empty.
+
+        The mtimes come from the scandir listing, so nothing is statted twice
+        and a directory whose mtime keeps being bumped is still pruned file
+        by file. rel is entry's path below the target for rule matching and
+        included says whether an include rule already covers it; with
+        by_age=False every file is treated as expired. Freed bytes are added
+        to freed. Returns the totals of what was kept (None if entry itself
+        was removed) and whether anything below entry failed, so every
+        ancestor of a failure drops its index row too.
+        """
+        cutoff = self.older_than_seconds if by_age else None
+        index = self.index if by_age else None
+        rules = self.rules
+        dir_mtime = 0.0
+        if index is not None:
+            dir_mtime = entry.stat(follow_symlinks=False).st_mtime
+            skipped = index.lookup(entry.path, dir_mtime, self.older_than_seconds, self.now)
+            if skipped is not None:
+                self.emit(DeleteEvent("skipped", Path(entry.path), True, "unchanged since last scan"))
+                return skipped, False
+        with os.scandir(entry.path) as it:
+            children = list(it)
+        kept = Tally()
+        keep_dir = False
+        changed = False
+        failed = False
+        doomed: List[Tuple[os.DirEntry, os.stat_result]] = []
+        for child in children:
+            is_dir = _is_tree_dir(child)
+            child_included = included
+            if rules is not None:
+                child_rel = f"{rel}/{child.name}" if rel else child.name
+                # An excluded directory is kept whole without descending.
+                if rules.excluded(child_rel, is_dir):
+                    keep_dir = True
+                    self.emit(DeleteEvent("skipped", Path(child.path), is_dir, "excluded"))
+                    continue
+                child_included = included or rules.included(child_rel, is_dir)
+                if not is_dir and not child_included:
+                    keep_dir = True
+                    self.emit(DeleteEvent("skipped", Path(child.path), False, "not included"))
+                    continue
+            try:
+                if is_dir:
+                    sub, sub_failed = self.prune_tree(
+                        child, freed, child_rel if rules is not None else "", child_included, by_age
+                    )
+                    failed = failed or sub_failed
+                    if sub is None:
+                        changed = True
+                    else:
+                        keep_dir = True
+                        kept.merge(sub)
+                    continue
+                st = child.stat(follow_symlinks=False)
+                if cutoff is not None and (self.now - st.st_mtime) < cutoff:
+                    keep_dir = True
+                    kept.add(st)
+                    self.emit(DeleteEvent("skipped", Path(child.path), False, "recent"))
+                    continue
+                doomed.append((child, st))
+            except FileNotFoundError:
+                changed = True
+            except OSError as exc:
+                keep_dir = failed = True
+                self.emit(_failure_event(Path(child.path), exc, is_dir))
+        # Expired files of this directory go to the deleter as one batch.
+        if self.dry_run:
+            errors: List[OSError | None] = [None] * len(doomed)
+        else:
+            errors = self.deleter.unlink_many([(child.path, st.st_size) for child, st in doomed])
+        for (child, st), error in zip(doomed, errors):
+            if error is None or isinstance(error, FileNotFoundError):
+                changed = True
+            if error is None:
+                freed.add(st)
+                self.emit(DeleteEvent(
+                    "would-delete" if self.dry_run else "deleted",
+                    Path(child.path),
+                    size=st.st_size,
+                    allocated=allocated_bytes(st),
+                ))
+            elif not isinstance(error, FileNotFoundError):
+                keep_dir = failed = True
+                self.emit(_failure_event(Path(child.path), error))
+        # A directory that was already empty is only removed once it is old
+        # itself, so a tool that just created it does not lose it. Under
+        # include rules, only directories that are included or that held
+        # included files are removed.
+        if keep_dir or (not children and _entry_is_recent(entry, cutoff, self.now)) or not (included or changed):
+            if index is not None and not self.dry_run:
+                # changed also counts files a dry run would have removed,
+                # which is why dry runs never write the index.
+                if failed:
+                    index.forget(entry.path)
+                else:
+                    # Our own deletions bumped the mtime; record the new one.
+                    mtime = os.stat(entry.path).st_mtime if changed else dir_mtime
+                    index.store(entry.path, mtime, kept, self.now)
+            return kept, failed
+        if self.dry_run:
+            self.emit(DeleteEvent("would-delete", Path(entry.path), True))
+            return None, False
+        self.deleter.rmdir(entry.path)
+        if index is not None:
+            index.forget(entry.path)
+        self.emit(DeleteEvent("deleted", Path(entry.path), True))
+        return None, False
+
 
+def _ordered_map(fn: Callable[[T], R], items: Iterable[T], workers: int) -> Iterator[R]:
+    """Map fn over items on a bounded pool, yielding results in input order.
+
+    Only a small window of futures is kept in flight so huge directories do
+    not queue millions of tasks up front.
+    """
+    if workers <= 1:
+        for item in items:
+            yield fn(item)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending: deque = deque()
+        for item in items:
+            pending.append(pool.submit(fn, item))
+            if len(pending) >= workers * 4:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
 
-def clean_directory(target: Path, dry_run: bool, older_than_seconds: int | None, result: DeleteResult) -> None:
+
+def clean_directory(
+    target: Path,
+    dry_run: bool,
+    older_than_seconds: int | None,
+    result: DeleteResult,
+    workers: int = 1,
+    prune: bool = False,
+    sink: EventSink | None = None,
+    report: HeaviestEntries | None = None,
+    echo: bool = True,
+    index: ScanIndex | None = None,
+    deleter: Deleter = _DIRECT,
+    rules: RuleSet | None = None,
+) -> None:
     if not target.exists():
         return
     # Ensure we only clean inside the target, not the target itself.
     now = time.time()
+    lock = Lock()
+
+    def emit(event: DeleteEvent) -> None:
+        # Events stream straight from the workers; the lock keeps the summary
+        # and any sink consistent without buffering per-entry results.
+        with lock:
+            result.record(event)
+            if echo and event.kind == "would-delete":
+                print(f"[DRY-RUN] Would delete: {event.path}")
+            if sink is not None:
+                sink(event)
+
+    walker = _Walker(dry_run, older_than_seconds, now, emit, prune, index, deleter, rules)
+
     try:
-        for entry in target.iterdir():
-            delete_path(entry, dry_run, older_than_seconds, now, result)
+        with os.scandir(target) as it:
+            # Top-level subtrees fan out across the pool; each worker removes
+            # whole subtrees and hands back their byte totals.
+            tasks = _top_level_tasks(it, Deleter.CHUNK_SIZE)
+            for totals in _ordered_map(walker.clean_entries, tasks, workers):
+                if report is not None:
+                    for path, tally in totals:
+                        report.add(Path(path), tally)
     except PermissionError as exc:
         result.log_failure(target, f"Permission denied: {exc}")
     except OSError as exc:
         result.log_failure(target, f"Failed to enumerate: {exc}")
 
 
-def format_failures(failed: List[Tuple[Path, str]] | None) -> str:
+def _device_of(target: Path) -> object:
+    try:
+        return os.stat(target).st_dev
+    except OSError:
+        # Missing targets are skipped by clean_directory; keep them apart.
+        return str(target)
+
+
+def clean_targets(
+    targets: List[Path],
+    clean: Callable[[Path, DeleteResult], None],
+    per_device: int = 1,
+) -> List[Tuple[Path, DeleteResult]]:
+    """Run clean(target, result) for every target concurrently.
+
+    Targets on different volumes proceed in parallel, while at most
+    per_device targets share one st_dev at a time, so wall time tracks the
+    slowest volume instead of the sum. Each target gets its own result;
+    they come back in target order.
+    """
+    # Each target's device is looked up once: a later stat could differ
+    # (a target removed or remounted meanwhile) and miss its semaphore.
+    limits: dict = {}
+    jobs = [
+        (target, limits.setdefault(_device_of(target), Semaphore(max(1, per_device))))
+        for target in targets
+    ]
+
+    def run(job: Tuple[Path, Semaphore]) -> Tuple[Path, DeleteResult]:
+        target, limit = job
+        result = DeleteResult()
+        with limit:
+            clean(target, result)
+        return target, result
+
+    if len(jobs) <= 1:
+        return [run(job) for job in jobs]
+    with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+        return list(pool.map(run, jobs))
+
+
+def format_bytes(num: int) -> str:
+    value = float(num)
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if value < 1024:
+            return f"{value:.1f} {unit}" if unit != "B" else f"{int(value)} B"
+        value /= 1024
+    return f"{value:.1f} TiB"
+
+
+def format_report(report: HeaviestEntries) -> str:
+    ranked = report.ranked()
+    if not ranked:
+        return ""
+    lines = [f"Heaviest {len(ranked)} entries:"]
+    for allocated, size, path in ranked:
+        lines.append(f"  {format_bytes(allocated):>10} on disk ({format_bytes(size)})  {path}")
+    return "\n".join(lines)
+
+
+def format_failures(failed: List[Tuple[Path, str]] | None, total: int | None = None) -> str:
     if not failed:
         return ""
     lines = ["Failures:"]
     for path, message in failed:
         lines.append(f"  - {path}: {message}")
+    if total is not None and total > len(failed):
+        lines.append(f"  ... and {total - len(failed)} more")
     return "\n".join(lines)
 
 
@@ -121,6 +1194,103 @@ def parse_args(argv: List[str]) -> argparse.Namespace:
         action="store_true",
         help="Show what would be removed without deleting anything.",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker threads deleting subtrees in parallel. Defaults to 1 (serial).",
+    )
+    parser.add_argument(
+        "--include",
+        action="append",
+        default=[],
+        metavar="GLOB",
+        help=(
+            "Only delete files matching this glob (e.g. '*.tmp'). Can be passed multiple times. "
+            "Globs without '/' match names at any depth; '**' spans directories; a trailing '/' matches directories."
+        ),
+    )
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        default=[],
+        metavar="GLOB",
+        help="Never delete entries matching this glob (e.g. '*.lock'); excluded directories are not descended.",
+    )
+    parser.add_argument(
+        "--rules-file",
+        help="File of '+ <glob>' include and '- <glob>' exclude lines, added to --include/--exclude.",
+    )
+    parser.add_argument(
+        "--max-per-device",
+        type=int,
+        default=1,
+        help="Targets cleaned at the same time on one volume. Targets on different volumes always run concurrently. Defaults to 1.",
+    )
+    parser.add_argument(
+        "--max-inflight",
+        type=int,
+        default=0,
+        help=(
+            "Maximum file removals in flight across all workers and targets; each directory's files are "
+            "split over this many threads. Raise for network or slow disks. Defaults to 0 (no cap)."
+        ),
+    )
+    parser.add_argument(
+        "--max-iops",
+        type=float,
+        default=0,
+        help="Cap removals at this many operations per second across all workers. Defaults to 0 (unlimited).",
+    )
+    parser.add_argument(
+        "--max-delete-rate",
+        type=float,
+        default=0,
+        metavar="MB_PER_SEC",
+        help="Cap deletion at this many MB of file data per second. Defaults to 0 (unlimited).",
+    )
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help=(
+            "Apply --older-than-days to every file inside directories and remove directories "
+            "only once they are empty, instead of judging each top-level entry as a whole. "
+            "Counts then cover every file and directory removed."
+        ),
+    )
+    parser.add_argument(
+        "--report-top",
+        type=int,
+        default=0,
+        metavar="K",
+        help=(
+            "Rank the K top-level entries that free the most space and print them instead of "
+            "one line per entry. Combine with --dry-run to size targets before cleaning."
+        ),
+    )
+    parser.add_argument(
+        "--index",
+        metavar="FILE",
+        help=(
+            "SQLite scan index used with --prune and --older-than-days. Subtrees that have not "
+            "changed and cannot yet hold expired files are skipped on later runs."
+        ),
+    )
+    parser.add_argument(
+        "--index-max-age-hours",
+        type=float,
+        default=24,
+        help="Rescan subtrees whose index entry is older than this. Defaults to 24.",
+    )
+    parser.add_argument(
+        "--rebuild-index",
+        action="store_true",
+        help="Discard the scan index and rescan everything.",
+    )
+    parser.add_argument(
+        "--events-jsonl",
+        help="Write one JSON line per deleted, skipped or failed entry to this file as the run progresses.",
+    )
     return parser.parse_args(argv)
 
 
@@ -130,7 +1300,8 @@ def main(argv: List[str]) -> int:
     if args.older_than_days > 0:
         older_than_seconds = int(args.older_than_days * 86400)
 
-    targets = iter_targets(args.path)
+    dropped: List[Tuple[Path, Path]] = []
+    targets = iter_targets(args.path, dropped)
     if not targets:
         print("No targets to clean. Set TEMP/TMP or pass --path.", file=sys.stderr)
         return 1
@@ -138,16 +1309,99 @@ def main(argv: List[str]) -> int:
     print("Targets:")
     for t in targets:
         print(f" - {t}")
+    for duplicate, owner in dropped:
+        print(f" - {duplicate} (skipped: covered by {owner})")
+
+    try:
+        if args.rules_file:
+            rules = RuleSet.from_file(Path(args.rules_file).expanduser(), args.include, args.exclude)
+        else:
+            rules = RuleSet(args.include, args.exclude)
+    except (OSError, ValueError, re.error) as exc:
+        print(f"Cannot load rules: {exc}", file=sys.stderr)
+        return 1
+
+    index = None
+    if args.index and not (args.prune and older_than_seconds is not None):
+        print("Ignoring --index: it only applies with --prune and --older-than-days.", file=sys.stderr)
+    elif args.index:
+        try:
+            index = ScanIndex(
+                Path(args.index).expanduser(),
+                max_age_seconds=args.index_max_age_hours * 3600,
+                rebuild=args.rebuild_index,
+                rules=rules.fingerprint() if rules else "",
+                dry_run=args.dry_run,
+            )
+        except (OSError, sqlite3.Error) as exc:
+            print(f"Cannot open scan index: {exc}", file=sys.stderr)
+            return 1
+
+    sink = None
+    if args.events_jsonl:
+        try:
+            sink = JsonlEventWriter(Path(args.events_jsonl).expanduser())
+        except OSError as exc:
+            print(f"Cannot open events file: {exc}", file=sys.stderr)
+            return 1
+
+    report = HeaviestEntries(args.report_top) if args.report_top > 0 else None
+    deleter = Deleter(
+        max_inflight=args.max_inflight,
+        max_iops=args.max_iops,
+        max_bytes_per_sec=args.max_delete_rate * 1024 * 1024,
+    )
+
+    def clean(target: Path, target_result: DeleteResult) -> None:
+        clean_directory(
+            target,
+            args.dry_run,
+            older_than_seconds,
+            target_result,
+            workers=max(1, args.workers),
+            prune=args.prune,
+            sink=sink,
+            report=report,
+            echo=report is None,
+            index=index,
+            deleter=deleter,
+            rules=rules,
+        )
+
+    try:
+        per_target = clean_targets(targets, clean, per_device=args.max_per_device)
+    finally:
+        deleter.close()
+        if sink is not None:
+            sink.close()
+        if index is not None:
+            index.close()
 
     result = DeleteResult()
-    for target in targets:
-        clean_directory(target, args.dry_run, older_than_seconds, result)
+    for _, target_result in per_target:
+        result.merge(target_result)
+
+    label = "Would free" if args.dry_run else "Freed"
+    print("\nPer target:")
+    for target, target_result in per_target:
+        print(
+            f" - {target}: {target_result.deleted_files} files, {target_result.deleted_dirs} dirs, "
+            f"{label.lower()} {format_bytes(target_result.bytes_freed)}, "
+            f"{target_result.failure_count} failures"
+        )
 
     print("\nSummary:")
     print(f"Deleted files: {result.deleted_files}")
     print(f"Deleted directories: {result.deleted_dirs}")
-    if result.failed:
-        print(format_failures(result.failed))
+    print(f"{label}: {format_bytes(result.bytes_freed)} ({format_bytes(result.allocated_freed)} on disk)")
+    if result.skipped:
+        print(f"Skipped: {result.skipped}")
+    if result.failure_count:
+        print(format_failures(result.failed, result.failure_count))
+    if report is not None and report.ranked():
+        print()
+        print(format_report(report))
+    if result.failure_count:
         return 2
     return 0
 
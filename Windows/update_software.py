@@ -1,8 +1,11 @@
-import subprocess, os, sys, ctypes, logging, argparse, shutil, time, json, glob
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from contextlib import contextmanager
-from dataclasses import dataclass, asdict
+import subprocess, os, sys, ctypes, logging, logging.handlers, argparse, shutil, time, json, glob, re, unicodedata
+import asyncio, atexit, base64, codecs, contextvars, itertools, locale, queue, random, signal, socket, threading
+from collections import Counter, deque
+from contextlib import contextmanager, nullcontext, suppress
+from dataclasses import dataclass, asdict, field
 from datetime import datetime
+from functools import partial
+from typing import Awaitable, Callable
 
 RICH_AVAILABLE = False
 try:
@@ -21,7 +24,7 @@ WINUPDATE_TIMEOUT = 7200
 CLEANUP_TIMEOUT = 3600
 NUGET_BOOTSTRAP_TIMEOUT = 180
 PSWINDOWSUPDATE_INSTALL_TIMEOUT = 600
-INTERNET_CHECK_TIMEOUT = 20
+INTERNET_CHECK_TIMEOUT = 5  # per DNS lookup / TCP connect
 REBOOT_DELAY_SEC = 5
 REBOOT_REG_PATHS = [
     r"HKLM:\SOFTWARE\Microsoft\Windows\CurrentVersion\WindowsUpdate\Auto Update\RebootRequired",
@@ -30,7 +33,25 @@ REBOOT_REG_PATHS = [
 PENDING_RENAME_PATH = r"HKLM:\SYSTEM\CurrentControlSet\Control\Session Manager"
 
 DEFAULT_TIMEOUT = None  # Overridable via CLI
+DEFAULT_IDLE_TIMEOUT = None  # Overridable via CLI
 DEFAULT_RETRIES = 1
+OUTPUT_TAIL_LINES = 200
+
+# Output lines worth surfacing at INFO while a long upgrade is running.
+WINGET_PROGRESS_MARKERS = (
+    "found ", "downloading ", "starting package install",
+    "successfully installed", "installer failed", "no applicable",
+)
+CHOCO_PROGRESS_MARKERS = (
+    "upgrading the following", "you have ", "the upgrade of ",
+    "not upgraded", "is the latest version", "chocolatey upgraded",
+)
+
+# How many phases may hold each resource class at once. Package managers
+# share the network and may overlap (as winget and choco always have), but
+# anything touching the CBS servicing stack (Windows Update, DISM, SFC)
+# must run alone.
+RESOURCE_LIMITS = {"network": 4, "installer": 2, "cbs": 1, "disk": 1}
 
 console = Console() if RICH_AVAILABLE else None
 
@@ -59,48 +80,112 @@ def _log_dir() -> str:
     return os.path.join(base, LOG_DIR_NAME)
 
 
+class _BufferedFileHandler(logging.FileHandler):
+    # Only the listener thread writes here; it flushes once the queue
+    # drains, so a burst of records becomes a single write.
+    def emit(self, record):
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+
+class _BatchingListener(logging.handlers.QueueListener):
+    def handle(self, record):
+        super().handle(record)
+        if self.queue.empty():
+            for handler in self.handlers:
+                handler.flush()
+
+
+_LOG_QUEUE: queue.Queue | None = None
+_LOG_LISTENER: _BatchingListener | None = None
+
+
 def setup_logging(level=logging.INFO):
+    global _LOG_QUEUE, _LOG_LISTENER
     log_dir = _log_dir()
     os.makedirs(log_dir, exist_ok=True)
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     log_file = os.path.join(log_dir, f"update_log_{timestamp}.log")
 
-    logging.getLogger().handlers.clear()
-    logging.getLogger().setLevel(level)
-
     fmt = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
 
-    fh = logging.FileHandler(log_file, encoding="utf-8")
+    # Callers (including winget/choco worker threads) only enqueue; file
+    # writes and console rendering happen on the listener thread.
+    fh = _BufferedFileHandler(log_file, encoding="utf-8")
     fh.setFormatter(fmt)
-    logging.getLogger().addHandler(fh)
-
-    latest = os.path.join(log_dir, "latest.log")
-    try:
-        lh = logging.FileHandler(latest, mode="w", encoding="utf-8")
-        lh.setFormatter(fmt)
-        logging.getLogger().addHandler(lh)
-    except Exception:
-        pass
+    handlers = [fh]
 
     if RICH_AVAILABLE:
         rh = RichHandler(console=console, show_time=True, show_path=False)
         rh.setLevel(level)
-        logging.getLogger().addHandler(rh)
+        handlers.append(rh)
     else:
         sh = logging.StreamHandler()
         sh.setFormatter(fmt)
-        logging.getLogger().addHandler(sh)
+        handlers.append(sh)
+
+    _LOG_QUEUE = queue.Queue()
+    _LOG_LISTENER = _BatchingListener(_LOG_QUEUE, *handlers, respect_handler_level=True)
+    _LOG_LISTENER.start()
+
+    root = logging.getLogger()
+    root.handlers.clear()
+    root.setLevel(level)
+    root.addHandler(logging.handlers.QueueHandler(_LOG_QUEUE))
+
+    # latest.log is a hard link to this run's log, so it fills as the run
+    # goes; filesystems without hard links get a copy at exit instead.
+    latest = os.path.join(log_dir, "latest.log")
+    linked = _replace_with(latest, lambda tmp: os.link(log_file, tmp))
+    atexit.register(_stop_logging, log_file, None if linked else latest)
 
     logging.info(f"Logs: {log_file}")
 
-    _rotate_logs(log_dir)
+    threading.Thread(
+        target=_rotate_logs, args=(log_dir,), name="log-rotate", daemon=True
+    ).start()
 
     return log_file
 
 
+def _replace_with(path: str, make: Callable[[str], None]) -> bool:
+    tmp = path + ".tmp"
+    try:
+        with suppress(FileNotFoundError):
+            os.remove(tmp)
+        make(tmp)
+        os.replace(tmp, path)
+        return True
+    except OSError:
+        return False
+
+
+def wait_for_logs():
+    """Block until queued log records have been written, so direct console
+    output (summary tables) lands after them."""
+    if _LOG_LISTENER is not None:
+        _LOG_QUEUE.join()
+
+
+def _stop_logging(log_file: str, copy_to: str | None):
+    # atexit runs this before logging.shutdown(): drain the queue and close
+    # the file, then copy it to latest.log if it could not be hard-linked.
+    global _LOG_LISTENER
+    if _LOG_LISTENER is None:
+        return
+    _LOG_LISTENER.stop()
+    for handler in _LOG_LISTENER.handlers:
+        handler.close()
+    _LOG_LISTENER = None
+    if copy_to:
+        _replace_with(copy_to, lambda tmp: shutil.copyfile(log_file, tmp))
+
+
 def _rotate_logs(log_dir: str):
     pattern = os.path.join(log_dir, "update_log_*.log")
-    log_files = sorted(glob.glob(pattern), key=os.path.getmtime, reverse=True)
+    log_files = sorted(glob.glob(pattern), key=_mtime, reverse=True)
     for old_log in log_files[MAX_LOG_FILES:]:
         try:
             os.remove(old_log)
@@ -109,6 +194,14 @@ def _rotate_logs(log_dir: str):
             pass
 
 
+def _mtime(path: str) -> float:
+    # Another run may rotate the same directory concurrently.
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0.0
+
+
 @contextmanager
 def phase_status(label: str):
     if RICH_AVAILABLE and console is not None:
@@ -119,59 +212,597 @@ def phase_status(label: str):
         yield None
 
 
+class Capabilities:
+    """Run-scoped memo of tool paths, versions and module availability.
+    With a path and TTL it also persists positive results between runs;
+    negative results are only remembered for the current run so a tool
+    installed in the meantime is picked up next time."""
+
+    def __init__(self):
+        self.path: str | None = None
+        self.ttl_seconds = 0.0
+        self._values: dict[str, object] = {}
+        self._stamps: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, path: str, ttl_seconds: float):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        try:
+            with open(path, encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        with self._lock:
+            for key, entry in saved.items():
+                if now - entry.get("at", 0) > ttl_seconds or key in self._values:
+                    continue
+                value = entry.get("value")
+                if _cached_path_exists(value):
+                    self._values[key] = value
+                    self._stamps[key] = entry["at"]
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._values
+
+    def get(self, key: str, default=None):
+        with self._lock:
+            return self._values.get(key, default)
+
+    def remember(self, key: str, value):
+        with self._lock:
+            self._values[key] = value
+            self._stamps[key] = time.time()
+
+    def forget(self, key: str):
+        with self._lock:
+            self._values.pop(key, None)
+            self._stamps.pop(key, None)
+
+    def probe(self, key: str, fn: Callable[[], object]):
+        """Return the cached value for key, running fn once to fill it."""
+        if key in self:
+            return self.get(key)
+        value = fn()
+        self.remember(key, value)
+        return value
+
+    def which(self, program: str) -> str | None:
+        return self.probe(f"which:{program}", lambda: shutil.which(program))
+
+    def save(self):
+        if not self.path or self.ttl_seconds <= 0:
+            return
+        with self._lock:
+            entries = {
+                key: {"value": value, "at": self._stamps[key]}
+                for key, value in self._values.items()
+                if value  # never persist a negative probe
+            }
+        try:
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(entries, f, indent=2)
+        except OSError as e:
+            logging.warning(f"Failed to write capability cache: {e}")
+
+
+def _cached_path_exists(value) -> bool:
+    # A cached tool path is only trusted while the file is still there.
+    path = value.get("path") if isinstance(value, dict) else value
+    return not isinstance(path, str) or not os.path.isabs(path) or os.path.exists(path)
+
+
+CAPABILITIES = Capabilities()
+
+
 def powershell_exe() -> str:
     for candidate in ("pwsh", "powershell"):
-        if shutil.which(candidate):
+        if CAPABILITIES.which(candidate):
             return candidate
     return "powershell"
 
 
-def run_command(
+class IdleTimeoutExpired(subprocess.TimeoutExpired):
+    """The command printed nothing for longer than its idle timeout."""
+
+    def __str__(self):
+        return f"Command '{self.cmd}' produced no output for {self.timeout} seconds"
+
+
+@dataclass
+class StreamResult:
+    returncode: int
+    stdout: str
+    stderr: str
+    duration_sec: float
+    output_bytes: int = 0
+
+
+_ACTIVITY = object()
+
+# Every live child process, keyed by pid, with the phase that started it, so
+# a phase timeout or Ctrl-C can kill exactly the right process trees even when
+# the command runs on a worker thread's event loop.
+_CHILDREN: dict[int, str | None] = {}
+_CANCELLED: set[str | None] = set()
+_CHILDREN_LOCK = threading.Lock()
+_CURRENT_PHASE: contextvars.ContextVar[str | None] = contextvars.ContextVar(
+    "current_phase", default=None
+)
+
+
+@dataclass
+class Span:
+    name: str
+    category: str
+    start: float
+    end: float
+    lane: str
+    span_id: int
+    parent_id: int | None
+    attrs: dict = field(default_factory=dict)
+
+
+_CURRENT_SPAN: contextvars.ContextVar[int | None] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+class Tracer:
+    """Records timed spans (phases, command attempts, process spawns and
+    backoff sleeps) for export as a Chrome trace or OTel-style JSONL. Each
+    phase gets its own lane; spans started inside a span become its
+    children, across asyncio tasks and to_thread workers alike."""
+
+    def __init__(self):
+        self.spans: list[Span] = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, category: str, **attrs):
+        span_id = next(self._ids)
+        parent = _CURRENT_SPAN.get()
+        token = _CURRENT_SPAN.set(span_id)
+        start = time.time()
+        try:
+            yield attrs
+        except BaseException as e:
+            attrs.setdefault("error", type(e).__name__)
+            raise
+        finally:
+            _CURRENT_SPAN.reset(token)
+            span = Span(
+                name, category, start, time.time(), _CURRENT_PHASE.get() or "main",
+                span_id, parent, attrs,
+            )
+            with self._lock:
+                self.spans.append(span)
+
+    def export_chrome(self, path: str):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        lanes = {lane: i for i, lane in enumerate(dict.fromkeys(s.lane for s in spans))}
+        pid = os.getpid()
+        events = [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": lane}}
+            for lane, tid in lanes.items()
+        ]
+        for s in spans:
+            events.append({
+                "name": s.name, "cat": s.category, "ph": "X", "pid": pid,
+                "tid": lanes[s.lane], "ts": int(s.start * 1e6),
+                "dur": int((s.end - s.start) * 1e6), "args": s.attrs,
+            })
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, default=str)
+
+    def export_jsonl(self, path: str):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        trace_id = os.urandom(16).hex()
+        with open(path, "w", encoding="utf-8") as f:
+            for s in spans:
+                f.write(json.dumps({
+                    "trace_id": trace_id,
+                    "span_id": f"{s.span_id:016x}",
+                    "parent_span_id": f"{s.parent_id:016x}" if s.parent_id else None,
+                    "name": s.name,
+                    "start_time_unix_nano": int(s.start * 1e9),
+                    "end_time_unix_nano": int(s.end * 1e9),
+                    "attributes": {"category": s.category, "phase": s.lane, **s.attrs},
+                }, default=str) + "\n")
+
+
+TRACER = Tracer()
+
+
+def _visible_text(line: str) -> str:
+    # Progress bars redraw with bare CRs; keep what the console would show.
+    return line.rstrip("\r").rsplit("\r", 1)[-1].rstrip()
+
+
+async def _read_output(
+    stream: asyncio.StreamReader, name: str, events: asyncio.Queue, sizes: Counter
+):
+    decoder = codecs.getincrementaldecoder(locale.getpreferredencoding(False))(errors="replace")
+    pending = ""
+    try:
+        while True:
+            chunk = await stream.read(65536)
+            if not chunk:
+                break
+            sizes[name] += len(chunk)
+            pending += decoder.decode(chunk)
+            *lines, pending = pending.split("\n")
+            for line in lines:
+                events.put_nowait((name, _visible_text(line)))
+            if not lines:
+                # A progress redraw without a newline still counts as activity.
+                cut = pending.rfind("\r")
+                if 0 <= cut < len(pending) - 1:
+                    pending = pending[cut + 1:]
+                events.put_nowait((name, _ACTIVITY))
+        pending += decoder.decode(b"", final=True)
+        if pending:
+            events.put_nowait((name, _visible_text(pending)))
+    finally:
+        events.put_nowait((name, None))
+
+
+def _kill_pid_tree(pid: int):
+    # Installers run as grandchildren; kill the whole tree on Windows.
+    if os.name == "nt":
+        subprocess.run(
+            ["taskkill", "/T", "/F", "/PID", str(pid)],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=False,
+        )
+        return
+    try:
+        os.kill(pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def _check_cancelled():
+    with _CHILDREN_LOCK:
+        if None in _CANCELLED or _CURRENT_PHASE.get() in _CANCELLED:
+            raise asyncio.CancelledError()
+
+
+def cancel_children(phase: str | None = None):
+    """Stop one phase (or, with None, the whole run): kill its child process
+    trees and make its further commands raise CancelledError."""
+    with _CHILDREN_LOCK:
+        _CANCELLED.add(phase)
+        pids = [pid for pid, owner in _CHILDREN.items() if phase is None or owner == phase]
+    for pid in pids:
+        _kill_pid_tree(pid)
+
+
+async def stream_command_async(
     command,
+    on_line: Callable[[str, str], None] | None = None,
+    timeout: float | None = None,
+    idle_timeout: float | None = None,
+    shell: bool = False,
+    capture_output: bool = True,
+    tail_lines: int = OUTPUT_TAIL_LINES,
+) -> StreamResult:
+    """Run a command, handing each stdout/stderr line to on_line(stream, line)
+    as it arrives. Only the last tail_lines lines per stream are kept, unless
+    capture_output asks for the full stdout. Raises TimeoutExpired after
+    timeout seconds in total and IdleTimeoutExpired after idle_timeout
+    seconds without any output. Cancelling the task kills the process tree."""
+    _check_cancelled()
+    start = time.time()
+    pipes = dict(stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    with TRACER.span("spawn", "spawn"):
+        if shell:
+            proc = await asyncio.create_subprocess_shell(command, **pipes)
+        else:
+            proc = await asyncio.create_subprocess_exec(*command, **pipes)
+    with _CHILDREN_LOCK:
+        _CHILDREN[proc.pid] = _CURRENT_PHASE.get()
+    events: asyncio.Queue = asyncio.Queue()
+    sizes: Counter = Counter()
+    readers = [
+        asyncio.create_task(_read_output(proc.stdout, "stdout", events, sizes)),
+        asyncio.create_task(_read_output(proc.stderr, "stderr", events, sizes)),
+    ]
+    tails = {"stdout": deque(maxlen=tail_lines), "stderr": deque(maxlen=tail_lines)}
+    captured = [] if capture_output else None
+    open_streams = 2
+    last_activity = start
+
+    def tail(name):
+        return "\n".join(tails[name])
+
+    try:
+        while open_streams:
+            now = time.time()
+            deadlines = []
+            if timeout:
+                deadlines.append(start + timeout - now)
+            if idle_timeout:
+                deadlines.append(last_activity + idle_timeout - now)
+            wait_for = min(deadlines) if deadlines else None
+            if wait_for is not None and wait_for <= 0:
+                if timeout and now - start >= timeout:
+                    raise subprocess.TimeoutExpired(command, timeout, output=tail("stdout"), stderr=tail("stderr"))
+                raise IdleTimeoutExpired(command, idle_timeout, output=tail("stdout"), stderr=tail("stderr"))
+            try:
+                name, line = await asyncio.wait_for(events.get(), wait_for)
+            except asyncio.TimeoutError:
+                continue
+            last_activity = time.time()
+            if line is None:
+                open_streams -= 1
+                continue
+            if line is _ACTIVITY or not line.strip():
+                continue
+            tails[name].append(line)
+            if captured is not None and name == "stdout":
+                captured.append(line)
+            logging.debug(f"  {name}> {line}")
+            if on_line is not None:
+                on_line(name, line)
+        remaining = None
+        if timeout:
+            remaining = max(0.0, start + timeout - time.time())
+        try:
+            returncode = await asyncio.wait_for(proc.wait(), remaining)
+        except asyncio.TimeoutError:
+            raise subprocess.TimeoutExpired(command, timeout, output=tail("stdout"), stderr=tail("stderr"))
+    except BaseException:
+        # Timeouts, cancellation and callback errors must not leave installers running.
+        if proc.returncode is None:
+            _kill_pid_tree(proc.pid)
+            await asyncio.shield(proc.wait())
+        raise
+    finally:
+        for reader in readers:
+            reader.cancel()
+        with _CHILDREN_LOCK:
+            _CHILDREN.pop(proc.pid, None)
+    _check_cancelled()
+    stdout = "\n".join(captured) if captured is not None else tail("stdout")
+    return StreamResult(
+        returncode, stdout, tail("stderr"), time.time() - start, sum(sizes.values())
+    )
+
+
+def progress_logger(tool: str, markers: tuple[str, ...]) -> Callable[[str, str], None]:
+    """on_line callback that surfaces milestone lines at INFO."""
+    def on_line(stream: str, line: str):
+        lo = line.strip().lower()
+        if stream == "stderr" or any(m in lo for m in markers):
+            logging.info(f"{tool}: {line.strip()[:200]}")
+    return on_line
+
+
+RETRY_BACKOFF_CAP = 30
+LOCK_POLL_SEC = 5
+LOCK_WAIT_MAX = 600  # per command
+DEFAULT_RETRY_BUDGET = 900  # seconds of retries and waits per run
+
+
+@dataclass(frozen=True)
+class RetryRule:
+    # strategy: "fail" (give up now), "backoff" (exponential with jitter,
+    # up to --retries attempts) or "wait_lock" (wait for the installer
+    # mutex; does not use up an attempt). A single_package pattern is only
+    # trusted for commands that touch one package: in `--all` output it may
+    # describe just one of many.
+    name: str
+    strategy: str
+    codes: frozenset = frozenset()
+    pattern: re.Pattern | None = None
+    single_package: bool = False
+
+
+# Return codes are checked first, against every rule; output patterns are
+# then tried in this order, so a lock or network error anywhere in the
+# output wins over a package-level message.
+RETRY_RULES = (
+    RetryRule(
+        "locked", "wait_lock", frozenset({1618, 0x80070652}),
+        re.compile(
+            r"another installation is already in progress|installer failed with exit code: 1618"
+            r"|chocolatey is already running|0x80070652",
+            re.I,
+        ),
+    ),
+    RetryRule(
+        "network", "backoff", frozenset({0x80072EE2, 0x80072EE7, 0x80072EFD}),
+        re.compile(
+            r"could not resolve|name resolution|unable to connect|"
+            r"connection (was )?(reset|closed|refused)|operation timed out|"
+            r"remote server returned an error: \(5\d\d\)|0x80072ee[27]|0x80072efd",
+            re.I,
+        ),
+    ),
+    RetryRule(
+        "permanent", "fail",
+        # winget: no installed package / no applicable upgrade
+        frozenset({0x8A150014, 0x8A15002B}),
+        re.compile(
+            r"no installed package found|no applicable (update|upgrade)|"
+            r"the package was not found|not found in the source|access is denied",
+            re.I,
+        ),
+        single_package=True,
+    ),
+)
+MULTI_PACKAGE_COMMAND = re.compile(r"\s--all\b|\bupgrade\s+all\b", re.I)
+TIMEOUT_RULE = RetryRule("timeout", "fail")  # a second full timeout rarely helps
+STALL_RULE = RetryRule("stalled", "backoff")
+HOST_CRASH_RULE = RetryRule("host_crash", "backoff")
+DEFAULT_RULE = RetryRule("error", "backoff")
+
+
+def classify_failure(err: Exception) -> RetryRule:
+    if isinstance(err, IdleTimeoutExpired):
+        return STALL_RULE
+    if isinstance(err, subprocess.TimeoutExpired):
+        return TIMEOUT_RULE
+    if isinstance(err, PowerShellHostError):
+        return HOST_CRASH_RULE
+    if isinstance(err, subprocess.CalledProcessError):
+        # Windows reports HRESULT exit codes unsigned; normalise either form.
+        code = err.returncode & 0xFFFFFFFF
+        for rule in RETRY_RULES:
+            if code in rule.codes:
+                return rule
+        text = f"{err.stderr or ''}\n{err.output or ''}"
+        many = MULTI_PACKAGE_COMMAND.search(str(err.cmd)) is not None
+        for rule in RETRY_RULES:
+            if rule.single_package and many:
+                continue
+            if rule.pattern and rule.pattern.search(text):
+                return rule
+    return DEFAULT_RULE
+
+
+class RetryBudget:
+    """Seconds the whole run may spend on retries: backoff sleeps, lock
+    waits and the retried attempts themselves. Once it is spent, every
+    failure is final. Shared by all phases, so it is locked."""
+
+    def __init__(self, seconds: float | None = DEFAULT_RETRY_BUDGET):
+        self._lock = threading.Lock()
+        self.configure(seconds)
+
+    def configure(self, seconds: float | None):
+        with self._lock:
+            self.remaining = float("inf") if not seconds else float(seconds)
+
+    def available(self) -> bool:
+        with self._lock:
+            return self.remaining > 0
+
+    def charge(self, seconds: float):
+        with self._lock:
+            self.remaining -= seconds
+
+
+RETRY_BUDGET = RetryBudget()
+
+
+def _backoff_delay(backoff: float, attempt: int) -> float:
+    # Equal jitter: phases that failed on the same network blip should not
+    # retry in lockstep, but the wait never drops below half the step.
+    step = min(RETRY_BACKOFF_CAP, backoff ** (attempt - 1))
+    return step / 2 + random.uniform(0, step / 2)
+
+
+def _msi_busy() -> bool:
+    # Windows Installer holds this mutex for the whole install transaction.
+    if os.name != "nt":
+        return False
+    handle = ctypes.windll.kernel32.OpenMutexW(0x00100000, False, "Global\\_MSIExecute")
+    if not handle:
+        return False
+    ctypes.windll.kernel32.CloseHandle(handle)
+    return True
+
+
+async def _wait_for_installer(limit: float) -> float:
+    started = time.monotonic()
+    while True:
+        await asyncio.sleep(min(LOCK_POLL_SEC, max(0.0, limit)))
+        waited = time.monotonic() - started
+        if waited >= limit or not _msi_busy():
+            return waited
+
+
+async def _run_with_retries(
+    describe: str,
+    attempt_once: Callable[[], Awaitable[StreamResult]],
     ignore_errors=False,
-    timeout: int | None = None,
     retries: int = 1,
     backoff: float = 2.0,
-    shell: bool = False,
+    success_codes: frozenset[int] | set[int] = frozenset(),
 ):
+    retries = max(1, retries)
     attempt = 0
+    counted = 0  # attempts that count against retries; lock waits don't
+    lock_waited = 0.0
     last_err = None
-    timeout = timeout if timeout and timeout > 0 else DEFAULT_TIMEOUT
-    while attempt < max(1, retries):
+    while True:
         attempt += 1
+        started = time.monotonic()
+        detail = ""
         try:
-            start = time.time()
-            result = subprocess.run(
-                command,
-                check=False,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                timeout=timeout,
-                shell=shell,
-            )
-            duration = time.time() - start
+            with TRACER.span(
+                describe.split(" ", 1)[0].rsplit(os.sep, 1)[-1], "command",
+                command=describe[:200], attempt=attempt,
+            ) as span:
+                result = await attempt_once()
+                span.update(rc=result.returncode, output_bytes=result.output_bytes)
+            duration = result.duration_sec
             out = (result.stdout or "").strip()
             err = (result.stderr or "").strip()
-            cmd_str = command if isinstance(command, str) else " ".join(command)
             if result.returncode == 0:
-                logging.info(f"Command succeeded ({duration:.1f}s): {cmd_str}")
+                logging.info(f"Command succeeded ({duration:.1f}s): {describe}")
                 return out
-            else:
-                msg = err or out
-                logging.warning(
-                    f"Command failed rc={result.returncode} (try {attempt}/{retries}): {cmd_str} | {msg[:400]}"
-                )
-                last_err = subprocess.CalledProcessError(
-                    result.returncode, command, output=out, stderr=err
+            if result.returncode in success_codes:
+                logging.info(
+                    f"Command succeeded rc={result.returncode} ({duration:.1f}s): {describe}"
                 )
+                return out
+            problem = f"Command failed rc={result.returncode}"
+            detail = f" | {(err or out)[:400]}"
+            last_err = subprocess.CalledProcessError(
+                result.returncode, describe, output=out, stderr=err
+            )
+        except IdleTimeoutExpired as e:
+            last_err = e
+            problem = f"Command silent for {e.timeout}s"
         except subprocess.TimeoutExpired as e:
             last_err = e
-            cmd_str = command if isinstance(command, str) else " ".join(command)
-            logging.warning(f"Command timeout (try {attempt}/{retries}): {cmd_str}")
-        if attempt < retries:
-            sleep_for = backoff ** (attempt - 1)
-            time.sleep(min(30, sleep_for))
+            problem = "Command timeout"
+        except PowerShellHostError as e:
+            last_err = e
+            problem = str(e)
+        if attempt > 1:
+            RETRY_BUDGET.charge(time.monotonic() - started)
+
+        rule = classify_failure(last_err)
+        if rule.strategy != "wait_lock":
+            counted += 1
+        logging.warning(
+            f"{problem} (try {attempt}, {rule.name}): {describe}{detail}"
+        )
+        if rule.strategy == "fail":
+            break
+        if rule.strategy == "wait_lock" and lock_waited >= LOCK_WAIT_MAX:
+            break
+        if rule.strategy == "backoff" and counted >= retries:
+            break
+        if not RETRY_BUDGET.available():
+            logging.warning(f"Retry budget for this run is spent; not retrying: {describe}")
+            break
+
+        if rule.strategy == "wait_lock":
+            with TRACER.span("lock_wait", "backoff", attempt=attempt) as span:
+                logging.info("Another installation is in progress; waiting for it to finish...")
+                waited = await _wait_for_installer(
+                    min(LOCK_WAIT_MAX - lock_waited, RETRY_BUDGET.remaining)
+                )
+                span.update(seconds=round(waited, 1))
+            lock_waited += waited
+        else:
+            waited = min(_backoff_delay(backoff, counted), RETRY_BUDGET.remaining)
+            with TRACER.span(
+                "backoff", "backoff", attempt=attempt, reason=rule.name, seconds=round(waited, 1)
+            ):
+                await asyncio.sleep(waited)
+        RETRY_BUDGET.charge(waited)
     if ignore_errors:
         return None
     if last_err:
@@ -179,37 +810,357 @@ def run_command(
     raise RuntimeError("Command failed with unknown error")
 
 
-def run_powershell(
+async def run_command_async(
+    command,
+    ignore_errors=False,
+    timeout: int | None = None,
+    retries: int = 1,
+    backoff: float = 2.0,
+    shell: bool = False,
+    on_line: Callable[[str, str], None] | None = None,
+    idle_timeout: int | None = None,
+    capture_output: bool = True,
+    success_codes: frozenset[int] | set[int] = frozenset(),
+):
+    """Run command with retries and return its stdout. Non-zero return
+    codes in success_codes count as success and are never retried."""
+    timeout = timeout if timeout and timeout > 0 else DEFAULT_TIMEOUT
+    # None falls back to the CLI default; 0 disables the idle check.
+    idle_timeout = DEFAULT_IDLE_TIMEOUT if idle_timeout is None else (idle_timeout or None)
+    return await _run_with_retries(
+        command if isinstance(command, str) else " ".join(command),
+        lambda: stream_command_async(
+            command,
+            on_line=on_line,
+            timeout=timeout,
+            idle_timeout=idle_timeout,
+            shell=shell,
+            capture_output=capture_output,
+        ),
+        ignore_errors=ignore_errors,
+        retries=retries,
+        backoff=backoff,
+        success_codes=success_codes,
+    )
+
+
+def run_command(command, **kwargs):
+    """Blocking wrapper around run_command_async, for code running on a
+    worker thread or outside the phase scheduler."""
+    return asyncio.run(run_command_async(command, **kwargs))
+
+
+class PowerShellHostError(subprocess.SubprocessError):
+    """The PowerShell host process died while serving a request."""
+
+
+# Runs inside the host: read one JSON request per line, run it in a child
+# scope and answer with one marked JSON line. Modules imported by a request
+# stay loaded for the next one.
+PS_HOST_SCRIPT = r"""
+$ErrorActionPreference = 'Continue'
+$ProgressPreference = 'SilentlyContinue'
+[Console]::OutputEncoding = [Text.Encoding]::UTF8
+while ($null -ne ($line = [Console]::In.ReadLine())) {
+    $req = $line | ConvertFrom-Json
+    $global:LASTEXITCODE = 0
+    $rc = 0; $out = ''; $err = ''
+    try {
+        $out = & ([ScriptBlock]::Create($req.script)) 2>&1 | Out-String -Width 4096
+        if ($global:LASTEXITCODE) { $rc = $global:LASTEXITCODE }
+    } catch {
+        $rc = 1; $err = $_ | Out-String -Width 4096
+    }
+    $resp = @{ id = $req.id; rc = $rc; output = $out; error = $err } | ConvertTo-Json -Compress
+    [Console]::Out.WriteLine('@@PSHOST@@ ' + $resp)
+    [Console]::Out.Flush()
+}
+"""
+
+
+class PowerShellHost:
+    """A long-lived PowerShell session answering framed requests over
+    stdin/stdout, restarted on demand after a crash or timeout. exe and args
+    can point at any program that speaks the same protocol."""
+
+    FRAME = "@@PSHOST@@ "
+
+    def __init__(self, exe: str | None = None, args: list[str] | None = None):
+        self.exe = exe or powershell_exe()
+        if args is None:
+            encoded = base64.b64encode(PS_HOST_SCRIPT.encode("utf-16-le")).decode("ascii")
+            args = ["-NoProfile", "-NonInteractive", "-ExecutionPolicy", "Bypass", "-EncodedCommand", encoded]
+        self.args = args
+        self._proc: subprocess.Popen | None = None
+        self._frames: queue.Queue = queue.Queue()
+        self._next_id = 0
+
+    def _start(self):
+        self._proc = subprocess.Popen(
+            [self.exe, *self.args],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            encoding="utf-8",
+            errors="replace",
+            bufsize=1,
+        )
+        self._frames = queue.Queue()
+        threading.Thread(
+            target=self._read_frames, args=(self._proc, self._frames), daemon=True
+        ).start()
+        logging.debug(f"Started PowerShell host pid={self._proc.pid}")
+
+    def _read_frames(self, proc: subprocess.Popen, frames: queue.Queue):
+        try:
+            for line in proc.stdout:
+                if line.startswith(self.FRAME):
+                    frames.put(json.loads(line[len(self.FRAME):]))
+                elif line.strip():
+                    logging.debug(f"  pwsh> {line.rstrip()}")
+        finally:
+            frames.put(None)
+
+    def alive(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None
+
+    def run(self, script: str, timeout: float | None = None) -> StreamResult:
+        _check_cancelled()
+        if not self.alive():
+            self._start()
+        # Bind this request to its own session: if it is abandoned and the
+        # host restarted, this thread must not touch the new process's queue.
+        proc, frames = self._proc, self._frames
+        self._next_id += 1
+        request_id = self._next_id
+        start = time.time()
+        with _CHILDREN_LOCK:
+            _CHILDREN[proc.pid] = _CURRENT_PHASE.get()
+        try:
+            try:
+                proc.stdin.write(json.dumps({"id": request_id, "script": script}) + "\n")
+                proc.stdin.flush()
+            except OSError:
+                self._drop(proc)
+                raise PowerShellHostError("PowerShell host exited before the request was sent")
+            while True:
+                remaining = None if not timeout else start + timeout - time.time()
+                try:
+                    if remaining is not None and remaining <= 0:
+                        raise queue.Empty
+                    frame = frames.get(timeout=remaining)
+                except queue.Empty:
+                    self._drop(proc)
+                    raise subprocess.TimeoutExpired("powershell host", timeout)
+                if frame is None:
+                    self._drop(proc)
+                    _check_cancelled()
+                    raise PowerShellHostError("PowerShell host exited mid-request")
+                if frame.get("id") == request_id:
+                    break
+        finally:
+            with _CHILDREN_LOCK:
+                _CHILDREN.pop(proc.pid, None)
+        output = "\n".join(l.rstrip() for l in (frame.get("output") or "").splitlines())
+        error = (frame.get("error") or "").strip()
+        return StreamResult(
+            int(frame.get("rc") or 0), output, error, time.time() - start,
+            len(output.encode("utf-8")) + len(error.encode("utf-8")),
+        )
+
+    def _drop(self, proc: subprocess.Popen):
+        # Kill the session a request ran on, leaving any newer one alone.
+        if self._proc is proc:
+            self._proc = None
+        if proc.poll() is None:
+            _kill_pid_tree(proc.pid)
+        proc.wait()
+
+    def close(self, kill: bool = False):
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        if not kill:
+            # Closing stdin ends the read loop and lets the host exit cleanly.
+            try:
+                proc.stdin.close()
+                proc.wait(timeout=5)
+                return
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+        _kill_pid_tree(proc.pid)
+        proc.wait()
+
+
+class PowerShellPool:
+    """Hands out idle PowerShell hosts so concurrent phases do not queue
+    behind one another, starting up to max_hosts sessions."""
+
+    def __init__(self, max_hosts: int = 3, exe: str | None = None, args: list[str] | None = None):
+        self.max_hosts = max_hosts
+        self.exe = exe
+        self.args = args
+        self._idle: list[PowerShellHost] = []
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> PowerShellHost | None:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+            if self._created < self.max_hosts:
+                self._created += 1
+                return PowerShellHost(self.exe, self.args)
+            return None
+
+    def release(self, host: PowerShellHost):
+        with self._lock:
+            self._idle.append(host)
+
+    def discard(self, host: PowerShellHost):
+        # The host is never handed out again; a fresh one takes its place.
+        host.close(kill=True)
+        with self._lock:
+            self._created -= 1
+
+    async def run(self, script: str, timeout: float | None = None) -> StreamResult:
+        while (host := self.try_acquire()) is None:
+            await asyncio.sleep(0.05)
+        try:
+            result = await asyncio.to_thread(host.run, script, timeout)
+        except asyncio.CancelledError:
+            # The worker thread may still be inside host.run. Killing the
+            # session ends it, but the host must not be reused meanwhile.
+            self.discard(host)
+            raise
+        except BaseException:
+            self.release(host)
+            raise
+        self.release(host)
+        return result
+
+    def close(self):
+        with self._lock:
+            hosts, self._idle = self._idle, []
+        for host in hosts:
+            host.close()
+
+
+# Set by main(); None runs each snippet in a fresh powershell process.
+POWERSHELL_POOL: PowerShellPool | None = None
+
+
+async def run_powershell_async(
     ps_script,
     ignore_errors=False,
     timeout: int | None = None,
     retries: int = DEFAULT_RETRIES,
+    idle_timeout: int | None = None,
 ):
-    exe = powershell_exe()
-    return run_command(
-        [exe, "-NoProfile", "-ExecutionPolicy", "Bypass", "-Command", ps_script],
+    pool = POWERSHELL_POOL
+    if pool is None:
+        exe = powershell_exe()
+        return await run_command_async(
+            [exe, "-NoProfile", "-ExecutionPolicy", "Bypass", "-Command", ps_script],
+            ignore_errors=ignore_errors,
+            timeout=timeout,
+            retries=retries,
+            idle_timeout=idle_timeout,
+        )
+    # The host returns output in one frame, so idle_timeout does not apply.
+    timeout = timeout if timeout and timeout > 0 else DEFAULT_TIMEOUT
+    summary = " ".join(ps_script.split())
+    return await _run_with_retries(
+        f"powershell[host]: {summary[:120]}",
+        lambda: pool.run(ps_script, timeout),
         ignore_errors=ignore_errors,
-        timeout=timeout,
         retries=retries,
     )
 
 
+def run_powershell(ps_script, **kwargs):
+    return asyncio.run(run_powershell_async(ps_script, **kwargs))
+
+
 def command_exists(program: str) -> bool:
     try:
-        return shutil.which(program) is not None
+        return CAPABILITIES.which(program) is not None
     except Exception:
         return False
 
 
-def check_internet() -> bool:
-    ps = (
-        "$ErrorActionPreference='SilentlyContinue';"
-        "foreach ($t in @('one.one.one.one','8.8.8.8','www.microsoft.com')) {"
-        "  if (Test-NetConnection -ComputerName $t -WarningAction SilentlyContinue -InformationLevel Quiet) { 'OK'; break }"
-        "}"
+# Endpoints each source needs; the "internet" set only proves general reachability.
+CONNECTIVITY_ENDPOINTS = {
+    "internet": [("one.one.one.one", 443), ("8.8.8.8", 53), ("www.microsoft.com", 443)],
+    "winget": [("cdn.winget.microsoft.com", 443)],
+    "chocolatey": [("community.chocolatey.org", 443)],
+    "store": [("storeedgefd.dsx.mp.microsoft.com", 443)],
+    "windows_update": [("fe2.update.microsoft.com", 443), ("download.windowsupdate.com", 80)],
+}
+
+
+async def _first_true(aws) -> bool:
+    """Await all at once; True as soon as one yields True, cancelling the rest."""
+    tasks = [asyncio.ensure_future(a) for a in aws]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            if await next_done:
+                return True
+        return False
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _tcp_connect(ip: str, port: int, timeout: float) -> bool:
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    with suppress(OSError):
+        await writer.wait_closed()
+    return True
+
+
+async def _endpoint_reachable(host: str, port: int, timeout: float) -> bool:
+    # Resolve, then race a connect to every address (IPv4 and IPv6 alike).
+    loop = asyncio.get_running_loop()
+    try:
+        infos = await asyncio.wait_for(
+            loop.getaddrinfo(host, port, type=socket.SOCK_STREAM), timeout
+        )
+    except (OSError, asyncio.TimeoutError):
+        return False
+    addresses = dict.fromkeys(info[4][:2] for info in infos)
+    return await _first_true(_tcp_connect(ip, p, timeout) for ip, p in addresses)
+
+
+async def check_internet_async(
+    endpoints: list[tuple[str, int]] | None = None,
+    timeout: float = INTERNET_CHECK_TIMEOUT,
+) -> bool:
+    """True once any endpoint accepts a TCP connection. All lookups and
+    connects run concurrently, each bounded by timeout seconds."""
+    endpoints = CONNECTIVITY_ENDPOINTS["internet"] if endpoints is None else endpoints
+    return await _first_true(_endpoint_reachable(h, p, timeout) for h, p in endpoints)
+
+
+async def probe_sources_async(
+    sources, endpoints: dict | None = None, timeout: float = INTERNET_CHECK_TIMEOUT
+) -> dict[str, bool]:
+    """Reachability of each source's own endpoints, probed concurrently."""
+    endpoints = CONNECTIVITY_ENDPOINTS if endpoints is None else endpoints
+    sources = [s for s in sources if s in endpoints]
+    reachable = await asyncio.gather(
+        *(check_internet_async(endpoints[s], timeout) for s in sources)
     )
-    out = run_powershell(ps, ignore_errors=True, timeout=INTERNET_CHECK_TIMEOUT)
-    return isinstance(out, str) and out.strip().upper() == "OK"
+    return dict(zip(sources, reachable))
+
+
+def check_internet() -> bool:
+    return asyncio.run(check_internet_async())
 
 
 @dataclass
@@ -221,11 +1172,39 @@ class PhaseResult:
     duration_sec: float
     details: str = ""
     error: str | None = None
+    started_at: float | None = None
+    finished_at: float | None = None
+    packages: list = field(default_factory=list)
 
 
-def prep_windows_update_module():
+@dataclass
+class Phase:
+    # run is either a plain function (executed on a worker thread) or a
+    # coroutine function (awaited on the scheduler's event loop). A resource
+    # listed n times takes n of its class's slots.
+    name: str
+    label: str
+    run: Callable[[], PhaseResult]
+    deps: tuple[str, ...] = ()
+    resources: tuple[str, ...] = ()
+    timeout: float | None = None
+
+
+async def prep_windows_update_module_async():
+    if CAPABILITIES.get("module:PSWindowsUpdate"):
+        logging.info("PSWindowsUpdate module already available (cached).")
+        return
+    out = await run_powershell_async(
+        "if (Get-Module -ListAvailable -Name PSWindowsUpdate) { 'yes' }",
+        ignore_errors=True,
+        retries=1,
+    )
+    if out == "yes":
+        CAPABILITIES.remember("module:PSWindowsUpdate", True)
+        logging.info("PSWindowsUpdate module already installed.")
+        return
     logging.info("Preparing PSWindowsUpdate module and providers...")
-    run_powershell(
+    await run_powershell_async(
         "$ErrorActionPreference='SilentlyContinue';"
         "try { [Net.ServicePointManager]::SecurityProtocol = "
         "[Net.SecurityProtocolType]::Tls12 -bor [Net.SecurityProtocolType]::Tls11 -bor [Net.SecurityProtocolType]::Tls } catch {};"
@@ -234,63 +1213,228 @@ def prep_windows_update_module():
         ignore_errors=True,
         timeout=NUGET_BOOTSTRAP_TIMEOUT,
     )
-    run_powershell(
+    installed = await run_powershell_async(
         "Install-Module -Name PSWindowsUpdate -Force -AllowClobber -Scope AllUsers",
         ignore_errors=True,
         timeout=PSWINDOWSUPDATE_INSTALL_TIMEOUT,
     )
+    if installed is not None:
+        CAPABILITIES.remember("module:PSWindowsUpdate", True)
+
+
+@dataclass(frozen=True)
+class WingetPackage:
+    name: str
+    id: str
+    current: str
+    available: str
+    source: str = ""
+
+    @property
+    def truncated(self) -> bool:
+        return self.id.endswith("…")
+
+    def same_package(self, other: "WingetPackage") -> bool:
+        # winget cuts long cells with an ellipsis; compare on the common prefix.
+        a, b = self.id.rstrip("…"), other.id.rstrip("…")
+        if self.truncated or other.truncated:
+            return a.startswith(b) or b.startswith(a)
+        return a == b
 
 
-def _winget_upgrades_available(timeout: int | None, retries: int) -> tuple[int, list[str]]:
-    """Return (count, package_names) of available winget upgrades.
-    Uses text parsing of winget upgrade output. Captures output even on
-    non-zero exit codes since winget returns non-zero when upgrades exist."""
+def _cell_width(ch: str) -> int:
+    if unicodedata.combining(ch):
+        return 0
+    return 2 if unicodedata.east_asian_width(ch) in ("W", "F") else 1
+
+
+def _column_starts(header: str, min_gap: int) -> list[int]:
+    starts, col, gap = [], 0, min_gap
+    for ch in header:
+        if ch == " ":
+            gap += 1
+        else:
+            if gap >= min_gap:
+                starts.append(col)
+            gap = 0
+        col += _cell_width(ch)
+    return starts
+
+
+def _cells(line: str, starts: list[int]) -> list[str]:
+    # Offsets are in console cells, so wide characters count twice.
+    cells = [[] for _ in starts]
+    col, idx = 0, -1
+    for ch in line:
+        while idx + 1 < len(starts) and col >= starts[idx + 1]:
+            idx += 1
+        if idx >= 0:
+            cells[idx].append(ch)
+        col += _cell_width(ch)
+    return ["".join(c).strip() for c in cells]
+
+
+def parse_winget_table(text: str) -> list[WingetPackage] | None:
+    """Parse the first table of `winget upgrade` output using the column
+    offsets of its header row. Works for localized headers as long as the
+    column order is Name, Id, Version, Available[, Source]. Output without
+    a table means nothing is pending; a header that cannot be read gives
+    None, since the packages it lists are unknown."""
+    lines = text.splitlines()
+    sep = next(
+        (i for i, l in enumerate(lines) if len(l.strip()) >= 10 and set(l.strip()) == {"-"}),
+        -1,
+    )
+    if sep < 1:
+        return []
+    header = lines[sep - 1]
+    starts = _column_starts(header, 1)
+    if len(starts) > 5:
+        starts = _column_starts(header, 2)
+    if len(starts) not in (4, 5):
+        logging.warning(f"Unrecognised winget table header: {header.strip()!r}")
+        return None
+    packages = []
+    for line in lines[sep + 1:]:
+        if not line.strip():
+            break
+        cells = _cells(line, starts) + [""]
+        name, pkg_id, current, available, source = cells[:5]
+        if not pkg_id or " " in pkg_id or not available:
+            break  # footer or the start of a second table
+        packages.append(WingetPackage(name, pkg_id, current, available, source))
+    return packages
+
+
+# What `winget upgrade` prints instead of a table when nothing is pending.
+WINGET_NOTHING_PENDING = re.compile(
+    r"No installed package found matching input criteria|No (applicable|available) upgrade found",
+    re.I,
+)
+
+
+def _winget_upgrades(timeout: int | None) -> list[WingetPackage] | None:
+    """List pending winget upgrades, or None if the listing failed. winget
+    exits non-zero when upgrades exist, so a table is trusted whatever the
+    return code; no table only means nothing is pending if winget exited 0
+    or said so."""
     try:
-        result = subprocess.run(
+        result = asyncio.run(stream_command_async(
             [
                 "winget", "upgrade", "--include-unknown",
                 "--accept-source-agreements", "--accept-package-agreements",
             ],
-            check=False,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
             timeout=timeout,
-        )
-        raw = (result.stdout or "").strip()
-        if not raw:
-            return 0, []
-        lines = raw.splitlines()
-        # Find the header line (contains "Name" and "Id" or "Available")
-        header_idx = -1
-        for i, line in enumerate(lines):
-            lo = line.lower()
-            if "name" in lo and ("id" in lo or "available" in lo):
-                header_idx = i
-                break
-        if header_idx < 0:
-            return 0, []
-        # Find the separator line (all dashes) after header
-        data_start = header_idx + 1
-        if data_start < len(lines) and set(lines[data_start].strip()) <= {"-", " "}:
-            data_start += 1
-        # Count data lines (skip footer lines like "X upgrades available")
-        packages = []
-        for line in lines[data_start:]:
-            stripped = line.strip()
-            if not stripped:
-                continue
-            # Footer lines typically contain "upgrades available" or similar
-            lo = stripped.lower()
-            if "upgrades available" in lo or "upgrade(s) available" in lo:
-                continue
-            if "upgrade individually" in lo or "winget upgrade" in lo:
-                continue
-            packages.append(stripped)
-        return len(packages), []
-    except (subprocess.TimeoutExpired, FileNotFoundError, OSError) as e:
+        ))
+    except (subprocess.TimeoutExpired, OSError) as e:
         logging.warning(f"Failed to check winget upgrades: {e}")
-        return 0, []
+        return None
+    packages = parse_winget_table(result.stdout)
+    if packages == [] and result.returncode != 0 and not WINGET_NOTHING_PENDING.search(result.stdout):
+        last = next((l.strip() for l in reversed(result.stdout.splitlines()) if l.strip()), "")
+        logging.warning(f"Failed to check winget upgrades (rc={result.returncode}): {last[:200]}")
+        return None
+    return packages
+
+
+@dataclass
+class PackageOutcome:
+    id: str
+    name: str
+    success: bool
+    duration_sec: float
+    error: str | None = None
+    skipped: bool = False
+
+
+@dataclass
+class WingetResult:
+    available: list[WingetPackage]
+    upgraded: list[WingetPackage]
+    remaining: list[WingetPackage]
+    outcomes: list[PackageOutcome] = field(default_factory=list)
+    # The pre-upgrade listing failed, so available is not known to be complete.
+    listing_failed: bool = False
+
+
+def diff_winget(
+    before: list[WingetPackage], after: list[WingetPackage]
+) -> tuple[list[WingetPackage], list[WingetPackage]]:
+    """Split the packages pending before an upgrade into (upgraded, remaining)."""
+    upgraded, remaining = [], []
+    for pkg in before:
+        match = next((a for a in after if pkg.same_package(a)), None)
+        if match is None or match.current != pkg.current:
+            upgraded.append(pkg)
+        else:
+            remaining.append(pkg)
+    return upgraded, remaining
+
+
+def _package_names(packages: list[WingetPackage], limit: int = 20) -> str:
+    names = ", ".join(p.name for p in packages[:limit])
+    return names + (f" (+{len(packages) - limit} more)" if len(packages) > limit else "")
+
+
+# Installer technologies that take the Windows Installer mutex (MSI error
+# 1618 when two run at once). Bundles and unknown types are treated the same.
+MSI_INSTALLER_TYPES = {"msi", "wix", "burn"}
+
+
+async def _winget_installer_type(pkg: WingetPackage, timeout: int | None) -> str:
+    key = f"installer:{pkg.id}"
+    if key in CAPABILITIES:
+        return CAPABILITIES.get(key) or "unknown"
+    try:
+        result = await stream_command_async(
+            ["winget", "show", "--id", pkg.id, "--exact", "--accept-source-agreements"],
+            timeout=timeout,
+        )
+    except (subprocess.TimeoutExpired, OSError):
+        return "unknown"
+    match = re.search(r"^\s*Installer Type:\s*(\S+)", result.stdout, re.MULTILINE | re.IGNORECASE)
+    kind = match.group(1).lower() if match else None
+    CAPABILITIES.remember(key, kind)
+    return kind or "unknown"
+
+
+async def _upgrade_winget_parallel(
+    packages: list[WingetPackage], jobs: int, timeout, retries
+) -> list[PackageOutcome]:
+    """Upgrade packages one `winget upgrade --id` at a time each, up to jobs
+    at once. Packages whose installer needs the MSI mutex (or whose type
+    could not be determined) take a shared lock so only one runs at a time."""
+    slots = asyncio.Semaphore(jobs)
+    msi_lock = asyncio.Lock()
+
+    async def upgrade(pkg: WingetPackage) -> PackageOutcome:
+        async with slots:
+            kind = await _winget_installer_type(pkg, timeout)
+        serial = kind in MSI_INSTALLER_TYPES or kind == "unknown"
+        async with msi_lock if serial else nullcontext():
+            async with slots:
+                logging.info(f"winget: upgrading {pkg.name} ({pkg.id}, {kind} installer)")
+                start = time.time()
+                try:
+                    await run_command_async(
+                        [
+                            "winget", "upgrade", "--id", pkg.id, "--exact",
+                            "--include-unknown",
+                            "--accept-source-agreements", "--accept-package-agreements",
+                        ],
+                        timeout=timeout,
+                        retries=retries,
+                        on_line=progress_logger(f"winget[{pkg.id}]", WINGET_PROGRESS_MARKERS),
+                        capture_output=False,
+                    )
+                    return PackageOutcome(pkg.id, pkg.name, True, time.time() - start)
+                except (subprocess.SubprocessError, OSError) as e:
+                    # The last line winget printed usually names the installer error.
+                    tail = (getattr(e, "stderr", None) or getattr(e, "output", None) or "").strip()
+                    error = tail.splitlines()[-1] if tail else str(e)
+                    return PackageOutcome(pkg.id, pkg.name, False, time.time() - start, error=error[:300])
+
+    return list(await asyncio.gather(*(upgrade(p) for p in packages)))
 
 
 def update_winget_packages(
@@ -298,10 +1442,12 @@ def update_winget_packages(
     timeout=None,
     retries=DEFAULT_RETRIES,
     dry_run=False,
-) -> int:
+    jobs: int = 1,
+) -> WingetResult:
+    empty = WingetResult([], [], [])
     if not command_exists("winget"):
         logging.info("Winget not found. Skipping.")
-        return 0
+        return empty
     logging.info("Updating Winget sources and packages...")
     run_command(
         ["winget", "source", "update"],
@@ -310,21 +1456,38 @@ def update_winget_packages(
         retries=retries,
     )
 
-    pre_count, packages = _winget_upgrades_available(timeout, retries)
-    if packages:
-        logging.info(f"Winget: {pre_count} upgrade(s) available: {', '.join(packages[:20])}")
+    listed = _winget_upgrades(timeout)
+    before = listed or []
+    if listed is None:
+        logging.warning("Winget: could not list upgrades; falling back to `winget upgrade --all`.")
+    elif before:
+        logging.info(f"Winget: {len(before)} upgrade(s) available: {_package_names(before)}")
     else:
-        logging.info(f"Winget: {pre_count} upgrade(s) available")
+        logging.info(f"Winget: {len(before)} upgrade(s) available")
 
+    # Truncated ids cannot be targeted, so those are left to `--all`.
+    targeted = [p for p in before if not p.truncated] if jobs > 1 else []
     if dry_run:
-        logging.info("[DRY RUN] Would run: winget upgrade --all")
+        if targeted:
+            logging.info(f"[DRY RUN] Would upgrade {len(targeted)} package(s) by id, {jobs} at a time")
+        if listed is None or len(targeted) < len(before):
+            logging.info("[DRY RUN] Would run: winget upgrade --all")
         if include_msstore:
             logging.info("[DRY RUN] Would run: winget upgrade --source msstore --all")
-        return pre_count
-
-    if pre_count == 0:
+        return WingetResult(before, [], before, listing_failed=listed is None)
+
+    outcomes = []
+    if targeted:
+        outcomes = asyncio.run(_upgrade_winget_parallel(targeted, jobs, timeout, retries))
+        failed = [o for o in outcomes if not o.success]
+        logging.info(
+            f"Winget: {len(outcomes) - len(failed)} of {len(outcomes)} per-package upgrade(s) succeeded"
+        )
+        for o in failed:
+            logging.warning(f"winget: {o.name} ({o.id}) failed after {o.duration_sec:.0f}s: {o.error}")
+    if listed == []:
         logging.info("All winget packages up to date. Skipping upgrade.")
-    else:
+    elif listed is None or len(targeted) < len(before):
         run_command(
             [
                 "winget", "upgrade", "--all", "--include-unknown",
@@ -333,6 +1496,8 @@ def update_winget_packages(
             ignore_errors=True,
             timeout=timeout,
             retries=retries,
+            on_line=progress_logger("winget", WINGET_PROGRESS_MARKERS),
+            capture_output=False,
         )
 
     if include_msstore:
@@ -345,72 +1510,154 @@ def update_winget_packages(
             ignore_errors=True,
             timeout=timeout,
             retries=retries,
+            on_line=progress_logger("winget", WINGET_PROGRESS_MARKERS),
+            capture_output=False,
         )
-    return pre_count
+
+    if listed is None:
+        return WingetResult([], [], [], outcomes, listing_failed=True)
+    if not before:
+        return empty
+    after = _winget_upgrades(timeout)
+    if after is None:
+        logging.warning("Could not re-list winget upgrades; changes unknown.")
+        return WingetResult(before, [], before, outcomes)
+    upgraded, remaining = diff_winget(before, after)
+    if remaining:
+        logging.warning(f"Winget: still pending after upgrade: {_package_names(remaining)}")
+    return WingetResult(before, upgraded, remaining, outcomes)
+
+
+# choco exit codes that mean "installed, reboot needed".
+CHOCO_REBOOT_CODES = {1641, 3010}
+
+
+@dataclass(frozen=True)
+class ChocoPackage:
+    name: str
+    current: str
+    available: str
+    pinned: bool = False
+
+
+def parse_choco_outdated(text: str) -> list[ChocoPackage]:
+    """Parse `choco outdated -r` records: name|current|available|pinned."""
+    packages = []
+    for line in text.splitlines():
+        parts = [p.strip() for p in line.split("|")]
+        if len(parts) < 3 or not parts[0]:
+            continue
+        pinned = len(parts) > 3 and parts[3].lower() == "true"
+        packages.append(ChocoPackage(parts[0], parts[1], parts[2], pinned))
+    return packages
+
+
+def _choco_outdated(timeout: int | None) -> list[ChocoPackage] | None:
+    """Run `choco outdated -r`; None means the check itself failed."""
+    try:
+        result = asyncio.run(stream_command_async(["choco", "outdated", "-r"], timeout=timeout))
+    except (subprocess.TimeoutExpired, FileNotFoundError, OSError) as e:
+        logging.warning(f"choco outdated check failed: {e}. Will attempt upgrade anyway.")
+        return None
+    if result.returncode != 0:
+        logging.warning(
+            f"choco outdated check failed (rc={result.returncode}). "
+            "Will attempt upgrade anyway."
+        )
+        return None
+    return parse_choco_outdated(result.stdout)
+
+
+async def _upgrade_choco_packages(
+    packages: list[ChocoPackage], timeout, retries
+) -> list[PackageOutcome]:
+    """Install packages one by one in order (choco holds a machine-wide
+    lock, so installs cannot overlap), each from the machine's configured
+    sources. chocolatey itself goes first; pinned packages are skipped."""
+    ordered = sorted(packages, key=lambda p: p.name.lower() != "chocolatey")
+    outcomes = []
+    for pkg in ordered:
+        if pkg.pinned:
+            logging.info(f"choco: skipping pinned {pkg.name} {pkg.current} (available {pkg.available})")
+            outcomes.append(PackageOutcome(pkg.name, pkg.name, True, 0.0, skipped=True))
+            continue
+        command = ["choco", "upgrade", pkg.name, "-y", "--version", pkg.available]
+        logging.info(f"choco: upgrading {pkg.name} {pkg.current} -> {pkg.available}")
+        start = time.time()
+        error = None
+        try:
+            await run_command_async(
+                command,
+                timeout=timeout,
+                retries=retries,
+                on_line=progress_logger(f"choco[{pkg.name}]", CHOCO_PROGRESS_MARKERS),
+                capture_output=False,
+                success_codes=CHOCO_REBOOT_CODES,
+            )
+        except subprocess.CalledProcessError as e:
+            tail = (e.stderr or e.output or "").strip()
+            error = (tail.splitlines()[-1] if tail else str(e))[:300]
+        except (subprocess.SubprocessError, OSError) as e:
+            error = str(e)[:300]
+        outcomes.append(PackageOutcome(pkg.name, pkg.name, error is None, time.time() - start, error=error))
+    return outcomes
 
 
 def update_chocolatey_packages(
     timeout=None, retries=DEFAULT_RETRIES, dry_run=False
-) -> int:
+) -> list[PackageOutcome] | int:
+    """Upgrade outdated packages one by one and return their outcomes. If
+    `choco outdated` itself fails, fall back to `choco upgrade all` and
+    return an estimated count of changed packages instead."""
     if not is_chocolatey_installed():
         logging.info("Skipping Chocolatey updates (not installed).")
-        return 0
+        return []
 
     # Check for outdated packages first
-    outdated_out = None
-    outdated_check_failed = False
-    try:
-        result = subprocess.run(
-            ["choco", "outdated", "-r"],
-            check=False,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            timeout=timeout,
-        )
-        if result.returncode == 0:
-            outdated_out = (result.stdout or "").strip()
-        else:
-            outdated_check_failed = True
-            logging.warning(
-                f"choco outdated check failed (rc={result.returncode}). "
-                "Will attempt upgrade anyway."
-            )
-    except (subprocess.TimeoutExpired, FileNotFoundError, OSError) as e:
-        outdated_check_failed = True
-        logging.warning(f"choco outdated check failed: {e}. Will attempt upgrade anyway.")
-
-    outdated_count = 0
-    if outdated_out:
-        outdated_lines = [l for l in outdated_out.splitlines() if l.strip()]
-        outdated_count = len(outdated_lines)
+    outdated = _choco_outdated(timeout)
 
     if dry_run:
-        if outdated_check_failed:
+        if outdated is None:
             logging.info("[DRY RUN] Chocolatey: outdated check failed, would attempt upgrade")
-        else:
-            logging.info(f"[DRY RUN] Chocolatey: {outdated_count} outdated package(s)")
-        if outdated_out:
-            for line in outdated_out.splitlines()[:20]:
-                logging.info(f"[DRY RUN]   {line}")
-        return outdated_count
-
-    if outdated_count == 0 and not outdated_check_failed:
+            return 0
+        logging.info(f"[DRY RUN] Chocolatey: {len(outdated)} outdated package(s)")
+        for pkg in outdated[:20]:
+            pin = " (pinned, would skip)" if pkg.pinned else ""
+            logging.info(f"[DRY RUN]   {pkg.name} {pkg.current} -> {pkg.available}{pin}")
+        return [
+            PackageOutcome(p.name, p.name, True, 0.0, skipped=p.pinned) for p in outdated
+        ]
+
+    if outdated == []:
         logging.info("All Chocolatey packages up to date. Skipping upgrade.")
-        return 0
+        return []
 
-    logging.info(f"Updating Chocolatey and {outdated_count} outdated package(s)...")
+    if outdated is not None:
+        pinned = sum(p.pinned for p in outdated)
+        logging.info(
+            f"Updating {len(outdated) - pinned} outdated Chocolatey package(s)"
+            + (f", skipping {pinned} pinned" if pinned else "") + "..."
+        )
+        outcomes = asyncio.run(_upgrade_choco_packages(outdated, timeout, retries))
+        CAPABILITIES.forget("version:choco")
+        return outcomes
+
+    logging.info("Updating Chocolatey and all packages...")
     run_command(
         ["choco", "upgrade", "chocolatey", "-y"],
         ignore_errors=True,
         timeout=timeout,
         retries=retries,
+        success_codes=CHOCO_REBOOT_CODES,
     )
+    CAPABILITIES.forget("version:choco")
     out = run_command(
         ["choco", "upgrade", "all", "-y"],
         ignore_errors=True,
         timeout=timeout,
         retries=retries,
+        on_line=progress_logger("choco", CHOCO_PROGRESS_MARKERS),
+        success_codes=CHOCO_REBOOT_CODES,
     )
     changed = 0
     if out:
@@ -425,18 +1672,33 @@ def update_chocolatey_packages(
     return changed
 
 
+def chocolatey_version() -> str | None:
+    def probe():
+        path = CAPABILITIES.which("choco")
+        if not path:
+            return None
+        try:
+            result = subprocess.run(
+                [path, "--version"],
+                check=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                timeout=60,
+            )
+        except Exception:
+            return None
+        return {"path": path, "version": result.stdout.strip()}
+
+    info = CAPABILITIES.probe("version:choco", probe)
+    return info["version"] if info else None
+
+
 def is_chocolatey_installed():
-    try:
-        subprocess.run(
-            ["choco", "--version"],
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-        return True
-    except Exception:
+    if chocolatey_version() is None:
         logging.info("Chocolatey not found.")
         return False
+    return True
 
 
 def update_windows(
@@ -449,25 +1711,44 @@ def update_windows(
         logging.info("[DRY RUN] Would run: Get-WindowsUpdate -Install -AcceptAll -IgnoreReboot")
         ps = (
             "$ErrorActionPreference='Continue';"
-            "Import-Module PSWindowsUpdate -Force;"
+            "Import-Module PSWindowsUpdate;"
             f"Get-WindowsUpdate {'-MicrosoftUpdate' if not skip_ms_update else ''};"
         )
         return run_powershell(ps, ignore_errors=True, timeout=timeout, retries=retries)
 
     logging.info("Applying Windows Updates (no reboot during process)...")
+    # Servicing can be silent for a long time, so no idle timeout here.
     ps = (
         "$ErrorActionPreference='Continue';"
-        "Import-Module PSWindowsUpdate -Force;"
+        "Import-Module PSWindowsUpdate;"
         "try {"
         f"    Get-WindowsUpdate -Install -AcceptAll -IgnoreReboot {'-MicrosoftUpdate' if not skip_ms_update else ''};"
         "} catch {"
         f"    Install-WindowsUpdate -Install -AcceptAll -IgnoreReboot {'-MicrosoftUpdate' if not skip_ms_update else ''};"
         "}"
     )
-    return run_powershell(ps, ignore_errors=False, timeout=timeout, retries=retries)
+    return run_powershell(
+        ps, ignore_errors=False, timeout=timeout, retries=retries, idle_timeout=0
+    )
+
+
+async def download_windows_updates_async(
+    skip_ms_update=False, timeout=None, retries=DEFAULT_RETRIES
+):
+    """Download pending updates without installing them; the install run
+    later picks them up from the Windows Update cache."""
+    logging.info("Downloading Windows Updates ahead of install...")
+    ps = (
+        "$ErrorActionPreference='Continue';"
+        "Import-Module PSWindowsUpdate;"
+        f"Get-WindowsUpdate -Download -AcceptAll -IgnoreReboot {'-MicrosoftUpdate' if not skip_ms_update else ''};"
+    )
+    return await run_powershell_async(
+        ps, ignore_errors=True, timeout=timeout, retries=retries, idle_timeout=0
+    )
 
 
-def update_windows_store(timeout=None, retries=DEFAULT_RETRIES, dry_run=False):
+async def update_windows_store_async(timeout=None, retries=DEFAULT_RETRIES, dry_run=False):
     if dry_run:
         logging.info("[DRY RUN] Would trigger Microsoft Store app updates")
         return None
@@ -478,7 +1759,7 @@ def update_windows_store(timeout=None, retries=DEFAULT_RETRIES, dry_run=False):
         "  try { Update-AppxPackage -Package $_.PackageFullName -ErrorAction Stop } catch {}"
         "} } catch {}"
     )
-    return run_powershell(ps, ignore_errors=True, timeout=timeout, retries=retries)
+    return await run_powershell_async(ps, ignore_errors=True, timeout=timeout, retries=retries)
 
 
 def check_reboot_required():
@@ -516,6 +1797,8 @@ def run_dism_health(
             ignore_errors=False,
             timeout=timeout,
             retries=retries,
+            idle_timeout=0,
+            capture_output=False,
         )
         dur = time.time() - start
         return PhaseResult(
@@ -540,7 +1823,8 @@ def run_sfc(timeout=None, dry_run=False) -> PhaseResult:
     start = time.time()
     try:
         run_command(
-            ["sfc", "/scannow"], ignore_errors=False, timeout=timeout, retries=1
+            ["sfc", "/scannow"], ignore_errors=False, timeout=timeout, retries=1,
+            idle_timeout=0, capture_output=False,
         )
         dur = time.time() - start
         return PhaseResult(
@@ -569,7 +1853,10 @@ def run_component_cleanup(
     if aggressive:
         args.append("/ResetBase")
     try:
-        run_command(args, ignore_errors=False, timeout=timeout, retries=1)
+        run_command(
+            args, ignore_errors=False, timeout=timeout, retries=1,
+            idle_timeout=0, capture_output=False,
+        )
         dur = time.time() - start
         return PhaseResult(
             name="cleanup_components", success=True, skipped=False, changed=0,
@@ -583,21 +1870,300 @@ def run_component_cleanup(
         )
 
 
+class UpdateState:
+    """What each update source looked like at the end of earlier runs
+    (update_state.json): when it was checked, whether anything was left to
+    do and a stamp of the source's local index. A source that finished
+    clean within fresh_seconds, and whose index has not changed since, is
+    skipped."""
+
+    def __init__(self):
+        self.path: str | None = None
+        self.fresh_seconds = 0.0
+        self._sources: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, path: str, fresh_seconds: float):
+        self.path = path
+        self.fresh_seconds = fresh_seconds
+        try:
+            with open(path, encoding="utf-8") as f:
+                self._sources = json.load(f).get("sources", {})
+        except (OSError, ValueError, AttributeError):
+            self._sources = {}
+
+    def fresh(self, source: str) -> dict | None:
+        """Return the recorded entry if source can be skipped, else None."""
+        if self.fresh_seconds <= 0:
+            return None
+        with self._lock:
+            entry = self._sources.get(source)
+        if not entry or not entry.get("clean"):
+            return None
+        if time.time() - entry.get("checked_at", 0) > self.fresh_seconds:
+            return None
+        if entry.get("index_stamp") != _source_index_stamp(source):
+            return None
+        return entry
+
+    def record(self, source: str, clean: bool):
+        entry = {
+            "checked_at": time.time(),
+            "clean": clean,
+            "index_stamp": _source_index_stamp(source),
+        }
+        with self._lock:
+            self._sources[source] = entry
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = {"version": 1, "sources": dict(self._sources)}
+        try:
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2)
+        except OSError as e:
+            logging.warning(f"Failed to write update state: {e}")
+
+
+def _source_index_paths(source: str) -> list[str]:
+    local = os.getenv("LOCALAPPDATA") or ""
+    if source == "winget":
+        return [os.path.join(
+            local, "Packages", "Microsoft.DesktopAppInstaller_8wekyb3d8bbwe",
+            "LocalState", "Microsoft.Winget.Source_8wekyb3d8bbwe",
+        )]
+    if source == "chocolatey":
+        root = os.getenv("ChocolateyInstall") or r"C:\ProgramData\chocolatey"
+        return [os.path.join(root, "lib")]
+    return []
+
+
+def _source_index_stamp(source: str) -> float | None:
+    # Newest mtime of the local index/package directories; a source update
+    # or an out-of-band install changes it and invalidates the skip.
+    stamps = []
+    for path in _source_index_paths(source):
+        try:
+            stamps.append(os.stat(path).st_mtime)
+        except OSError:
+            pass
+    return max(stamps) if stamps else None
+
+
+UPDATE_STATE = UpdateState()
+
+
+def _fresh_result(name: str, source: str) -> PhaseResult | None:
+    entry = UPDATE_STATE.fresh(source)
+    if entry is None:
+        return None
+    checked = datetime.fromtimestamp(entry["checked_at"]).strftime("%H:%M")
+    logging.info(f"Skipping {name}: nothing pending as of {checked} (update state cache).")
+    return PhaseResult(name, True, True, 0, 0.0, details=f"Up to date as of {checked} (cached)")
+
+
+REPORT_RUNS = 30
+REGRESSION_WINDOW = 5  # newest runs compared against the rest
+REGRESSION_RATIO = 1.25
+REGRESSION_MIN_SEC = 5.0
+
+
+class RunHistory:
+    """Append-only run log (run_history.jsonl): one compact JSON line per
+    run with each phase's duration and outcome, so reports read a single
+    file tail instead of every summary or log file."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def append(self, results: list[PhaseResult], needs_reboot: bool):
+        record = {
+            "v": 1,
+            "ts": round(time.time(), 3),
+            "host": os.getenv("COMPUTERNAME") or socket.gethostname(),
+            "needs_reboot": needs_reboot,
+            "phases": {
+                r.name: {
+                    "duration": round(r.duration_sec, 3),
+                    "success": r.success,
+                    "skipped": r.skipped,
+                    "changed": r.changed,
+                }
+                for r in results
+            },
+        }
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        try:
+            # A single write in append mode keeps concurrent runs from
+            # interleaving partial lines.
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+        except OSError as e:
+            logging.warning(f"Failed to append run history: {e}")
+
+    def recent(self, runs: int) -> list[dict]:
+        """The newest `runs` records, oldest first."""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                lines = deque(f, maxlen=runs)
+        except OSError:
+            return []
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue  # torn line from an interrupted write
+        return records
+
+
+@dataclass
+class PhaseStats:
+    name: str
+    runs: int
+    failures: int
+    p50: float | None
+    p95: float | None
+    last: float | None
+    baseline: float | None  # median before the regression window
+    regressed: bool
+
+    @property
+    def failure_rate(self) -> float:
+        return self.failures / self.runs if self.runs else 0.0
+
+
+def _percentile(values: list[float], pct: float) -> float | None:
+    # Nearest-rank percentile; run counts are small, so no interpolation.
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def phase_stats(records: list[dict]) -> list[PhaseStats]:
+    durations: dict[str, list[float]] = {}
+    runs: Counter = Counter()
+    failures: Counter = Counter()
+    for record in records:
+        for name, p in record.get("phases", {}).items():
+            if p.get("skipped"):
+                continue
+            runs[name] += 1
+            if not p.get("success"):
+                failures[name] += 1
+            durations.setdefault(name, []).append(float(p.get("duration", 0.0)))
+    stats = []
+    for name in sorted(runs):
+        values = durations.get(name, [])
+        recent, earlier = values[-REGRESSION_WINDOW:], values[:-REGRESSION_WINDOW]
+        baseline = _percentile(earlier, 50)
+        current = _percentile(recent, 50)
+        regressed = (
+            baseline is not None
+            and current is not None
+            and len(earlier) >= REGRESSION_WINDOW
+            and current > baseline * REGRESSION_RATIO
+            and current - baseline >= REGRESSION_MIN_SEC
+        )
+        stats.append(PhaseStats(
+            name, runs[name], failures[name],
+            _percentile(values, 50), _percentile(values, 95),
+            values[-1] if values else None, baseline, regressed,
+        ))
+    return stats
+
+
+def _print_report(history: RunHistory, runs: int):
+    records = history.recent(runs)
+    if not records:
+        logging.info(f"No run history yet ({history.path}).")
+        return
+    since = datetime.fromtimestamp(records[0]["ts"]).strftime("%Y-%m-%d %H:%M")
+    title = f"Phase history: last {len(records)} runs since {since}"
+    stats = phase_stats(records)
+
+    def secs(v):
+        return "-" if v is None else f"{v:.1f}s"
+
+    if RICH_AVAILABLE and console is not None:
+        wait_for_logs()
+        table = Table(title=title, show_lines=True)
+        table.add_column("Phase", style="bold")
+        table.add_column("Runs", justify="right")
+        table.add_column("Fail %", justify="right")
+        table.add_column("p50", justify="right")
+        table.add_column("p95", justify="right")
+        table.add_column("Last", justify="right")
+        table.add_column("Trend")
+        for s in stats:
+            trend = (
+                f"[red]SLOWER[/red] ({secs(s.baseline)} -> recent)"
+                if s.regressed else ""
+            )
+            fail = f"{s.failure_rate:.0%}"
+            table.add_row(
+                s.name, str(s.runs),
+                f"[red]{fail}[/red]" if s.failures else fail,
+                secs(s.p50), secs(s.p95), secs(s.last), trend,
+            )
+        console.print(table)
+    else:
+        logging.info(f"{title}:")
+        for s in stats:
+            trend = f" | SLOWER than {secs(s.baseline)} baseline" if s.regressed else ""
+            logging.info(
+                f" - {s.name}: runs={s.runs} | fail={s.failure_rate:.0%} | "
+                f"p50={secs(s.p50)} | p95={secs(s.p95)} | last={secs(s.last)}{trend}"
+            )
+    regressed = [s.name for s in stats if s.regressed]
+    if regressed:
+        logging.warning(
+            f"Phases slower over the last {REGRESSION_WINDOW} runs: {', '.join(regressed)}"
+        )
+
+
 def _run_winget_phase(
-    include_msstore, timeout, retries, dry_run
+    include_msstore, timeout, retries, dry_run, jobs=1
 ) -> PhaseResult:
+    if not dry_run and (cached := _fresh_result("winget", "winget")):
+        return cached
     start = time.time()
     try:
-        changed = update_winget_packages(
+        outcome = update_winget_packages(
             include_msstore=include_msstore,
             timeout=timeout,
             retries=retries,
             dry_run=dry_run,
+            jobs=jobs,
         )
         dur = time.time() - start
+        if dry_run:
+            return PhaseResult(
+                "winget", True, False, len(outcome.available), dur,
+                details=f"Upgrades available: {len(outcome.available)}",
+            )
+        failed = [o for o in outcome.outcomes if not o.success]
+        if outcome.listing_failed:
+            # Nothing is known about what was pending, so this run must not
+            # count as clean for --fresh-minutes.
+            return PhaseResult(
+                "winget", True, False, 0, dur,
+                details="Upgrade listing failed; ran winget upgrade --all",
+                error=f"{len(failed)} package upgrade(s) failed" if failed else None,
+                packages=outcome.outcomes,
+            )
+        details = f"Upgraded {len(outcome.upgraded)} of {len(outcome.available)}"
+        if outcome.remaining:
+            details += f"; pending: {_package_names(outcome.remaining, 5)}"
+        UPDATE_STATE.record("winget", not outcome.remaining)
         return PhaseResult(
-            "winget", True, False, changed, dur,
-            details=f"Upgrades available: {changed}",
+            "winget", True, False, len(outcome.upgraded), dur, details=details,
+            error=f"{len(failed)} package upgrade(s) failed" if failed else None,
+            packages=outcome.outcomes,
         )
     except Exception as e:
         dur = time.time() - start
@@ -605,127 +2171,411 @@ def _run_winget_phase(
 
 
 def _run_choco_phase(timeout, retries, dry_run) -> PhaseResult:
+    if not dry_run and (cached := _fresh_result("chocolatey", "chocolatey")):
+        return cached
     start = time.time()
     try:
-        changed = update_chocolatey_packages(
+        outcome = update_chocolatey_packages(
             timeout=timeout, retries=retries, dry_run=dry_run
         )
         dur = time.time() - start
+        if isinstance(outcome, int):
+            return PhaseResult(
+                "chocolatey", True, False, outcome, dur,
+                details=f"Packages changed (estimated): {outcome}",
+            )
+        done = [o for o in outcome if not o.skipped]
+        ok = [o for o in done if o.success]
+        pinned = len(outcome) - len(done)
+        verb = "Would upgrade" if dry_run else "Upgraded"
+        details = f"{verb} {len(done) if dry_run else len(ok)} of {len(done)}"
+        if pinned:
+            details += f"; {pinned} pinned skipped"
+        failed = len(done) - len(ok)
+        if not dry_run:
+            # Pinned packages stay outdated by design and do not count as work left.
+            UPDATE_STATE.record("chocolatey", failed == 0)
         return PhaseResult(
-            "chocolatey", True, False, changed, dur,
-            details=f"Packages changed: {changed}",
+            "chocolatey", True, False, len(done) if dry_run else len(ok), dur,
+            details=details,
+            error=f"{failed} package upgrade(s) failed" if failed else None,
+            packages=outcome,
         )
     except Exception as e:
         dur = time.time() - start
         return PhaseResult("chocolatey", False, False, 0, dur, error=str(e))
 
 
-def run_updates(
-    include_msstore=True,
-    include_winupdate=True,
-    include_winget=True,
-    include_choco=True,
-    timeout=None,
-    retries=DEFAULT_RETRIES,
-    dry_run=False,
-    parallel=True,
-):
-    results: list[PhaseResult] = []
-
-    internet = check_internet()
+async def _run_preflight_phase(include_winupdate, sources=()) -> PhaseResult:
+    start = time.time()
+    internet, reachable = await asyncio.gather(
+        check_internet_async(), probe_sources_async(sources)
+    )
     logging.info(f"Internet connectivity: {internet}")
+    unreachable = [s for s, ok in reachable.items() if not ok]
+    if internet and unreachable:
+        logging.warning(f"Update endpoints unreachable for: {', '.join(unreachable)}")
 
-    if include_winupdate and internet:
-        prep_windows_update_module()
+    if include_winupdate and internet and UPDATE_STATE.fresh("windows_update") is None:
+        await prep_windows_update_module_async()
     elif include_winupdate and not internet:
         logging.warning("No internet: Windows Update may be limited or delayed.")
+    dur = time.time() - start
+    details = "Internet OK" if internet else "No internet"
+    if internet and unreachable:
+        details += f"; unreachable: {', '.join(unreachable)}"
+    return PhaseResult("preflight", True, False, 0, dur, details=details)
 
-    run_winget = include_winget
-    choco_installed = is_chocolatey_installed() if include_choco else False
-    run_choco = include_choco and choco_installed
-    skip_choco_msg = include_choco and not choco_installed
-
-    if parallel and run_winget and run_choco:
-        label = "Updating winget and Chocolatey packages in parallel"
-        with phase_status(label):
-            with ThreadPoolExecutor(max_workers=2) as executor:
-                futures = {}
-                futures[executor.submit(
-                    _run_winget_phase, include_msstore, timeout, retries, dry_run
-                )] = "winget"
-                futures[executor.submit(
-                    _run_choco_phase, timeout, retries, dry_run
-                )] = "choco"
-                for future in as_completed(futures):
-                    results.append(future.result())
-    else:
-        # Sequential fallback
-        if run_choco:
-            with phase_status("Updating Chocolatey packages"):
-                results.append(_run_choco_phase(timeout, retries, dry_run))
-        elif skip_choco_msg:
-            results.append(
-                PhaseResult(
-                    "chocolatey", True, True, 0, 0.0,
-                    details="Chocolatey not installed",
-                )
-            )
 
-        if run_winget:
-            with phase_status("Updating winget packages"):
-                results.append(
-                    _run_winget_phase(include_msstore, timeout, retries, dry_run)
-                )
+def _run_choco_or_skip(timeout, retries, dry_run) -> PhaseResult:
+    if not is_chocolatey_installed():
+        return PhaseResult(
+            "chocolatey", True, True, 0, 0.0,
+            details="Chocolatey not installed",
+        )
+    return _run_choco_phase(timeout, retries, dry_run)
 
-    if include_msstore:
-        with phase_status("Updating Microsoft Store apps"):
-            start = time.time()
-            try:
-                update_windows_store(timeout=timeout, retries=retries, dry_run=dry_run)
-                dur = time.time() - start
-                results.append(
-                    PhaseResult(
-                        "store", True, False, 0, dur,
-                        details="Store update triggered",
-                    )
-                )
-            except Exception as e:
-                dur = time.time() - start
-                results.append(PhaseResult("store", False, False, 0, dur, error=str(e)))
 
-    if include_winupdate:
-        with phase_status("Running Windows Update"):
-            start = time.time()
+async def _run_store_phase(timeout, retries, dry_run) -> PhaseResult:
+    start = time.time()
+    try:
+        await update_windows_store_async(timeout=timeout, retries=retries, dry_run=dry_run)
+        dur = time.time() - start
+        return PhaseResult(
+            "store", True, False, 0, dur,
+            details="Store update triggered",
+        )
+    except Exception as e:
+        dur = time.time() - start
+        return PhaseResult("store", False, False, 0, dur, error=str(e))
+
+
+async def _run_prefetch_phase(timeout, retries, dry_run) -> PhaseResult:
+    # Chocolatey is not prefetched: open-source choco cannot install a
+    # downloaded package without --source, which would override the
+    # machine's configured (possibly internal-only) sources.
+    start = time.time()
+    if dry_run:
+        return PhaseResult("prefetch", True, True, 0, 0.0, details="Dry run: nothing downloaded")
+    if UPDATE_STATE.fresh("windows_update") is not None:
+        return PhaseResult("prefetch", True, True, 0, 0.0, details="Nothing to prefetch (cached)")
+    out = await download_windows_updates_async(
+        timeout=max(timeout or 0, WINUPDATE_TIMEOUT), retries=retries
+    )
+    return PhaseResult(
+        "prefetch", True, False, 0, time.time() - start,
+        details="Windows Update payloads downloaded" if out is not None else "Windows Update download failed",
+    )
+
+
+def _run_winupdate_phase(timeout, retries, dry_run) -> PhaseResult:
+    if not dry_run and (cached := _fresh_result("windows_update", "windows_update")):
+        return cached
+    start = time.time()
+    try:
+        out = update_windows(
+            timeout=max(timeout or 0, WINUPDATE_TIMEOUT),
+            retries=retries,
+            dry_run=dry_run,
+        )
+        dur = time.time() - start
+        if not dry_run:
+            # PSWindowsUpdate prints a row per update it handled; no rows
+            # means nothing was pending.
+            handled = [l for l in (out or "").splitlines() if l.strip()]
+            UPDATE_STATE.record("windows_update", not handled)
+        return PhaseResult(
+            "windows_update", True, False, 0, dur,
+            details="Windows Update completed",
+        )
+    except Exception as e:
+        dur = time.time() - start
+        return PhaseResult("windows_update", False, False, 0, dur, error=str(e))
+
+
+async def _timed(phase: Phase) -> PhaseResult:
+    started = time.time()
+    token = _CURRENT_PHASE.set(phase.name)
+    try:
+        with TRACER.span(phase.name, "phase") as span:
             try:
-                update_windows(
-                    timeout=max(timeout or 0, WINUPDATE_TIMEOUT),
-                    retries=retries,
-                    dry_run=dry_run,
-                )
-                dur = time.time() - start
-                results.append(
-                    PhaseResult(
-                        "windows_update", True, False, 0, dur,
-                        details="Windows Update completed",
-                    )
+                if asyncio.iscoroutinefunction(phase.run):
+                    work = phase.run()
+                else:
+                    # to_thread copies the context, so the phase name follows along.
+                    work = asyncio.to_thread(phase.run)
+                result = await asyncio.wait_for(work, phase.timeout)
+            except asyncio.TimeoutError:
+                cancel_children(phase.name)
+                result = PhaseResult(
+                    phase.name, False, False, 0, time.time() - started,
+                    error=f"Phase timed out after {phase.timeout:.0f}s",
                 )
+            except asyncio.CancelledError:
+                cancel_children(phase.name)
+                raise
             except Exception as e:
-                dur = time.time() - start
-                results.append(
-                    PhaseResult("windows_update", False, False, 0, dur, error=str(e))
+                result = PhaseResult(phase.name, False, False, 0, time.time() - started, error=str(e))
+            span.update(success=result.success, skipped=result.skipped, changed=result.changed)
+    finally:
+        _CURRENT_PHASE.reset(token)
+    result.started_at = started
+    result.finished_at = time.time()
+    return result
+
+
+async def run_phase_graph_async(
+    phases: list[Phase], max_parallel: int | None = None, status=None
+) -> dict[str, PhaseResult]:
+    names = {p.name for p in phases}
+    limit = max(1, max_parallel or len(phases))
+    pending = list(phases)
+    running: dict[asyncio.Task, Phase] = {}
+    in_use: Counter = Counter()
+    results: dict[str, PhaseResult] = {}
+
+    def fits(phase: Phase) -> bool:
+        if any(d in names and d not in results for d in phase.deps):
+            return False
+        for r, n in Counter(phase.resources).items():
+            cap = RESOURCE_LIMITS.get(r, 1)
+            if in_use[r] + min(n, cap) > cap:
+                return False
+        return True
+
+    try:
+        while pending or running:
+            for phase in list(pending):
+                if len(running) >= limit:
+                    break
+                if not fits(phase):
+                    continue
+                pending.remove(phase)
+                in_use.update(phase.resources)
+                if status is None:
+                    logging.info(f"{phase.label}...")
+                running[asyncio.create_task(_timed(phase))] = phase
+            if status is not None:
+                status.update(
+                    "[bold cyan]" + ", ".join(p.label for p in running.values()) + "..."
                 )
-    else:
+            finished, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in finished:
+                phase = running.pop(task)
+                in_use.subtract(phase.resources)
+                results[phase.name] = task.result()
+    except BaseException:
+        # Ctrl-C or an outer cancel: kill every child, including those
+        # started from worker threads, then let the phase tasks unwind.
+        cancel_children()
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        raise
+    return results
+
+
+def run_phase_graph(phases: list[Phase], max_parallel: int | None = None) -> list[PhaseResult]:
+    """Run phases as soon as their dependencies have finished and their
+    resource classes (see RESOURCE_LIMITS) have room, so independent
+    phases overlap. Dependencies only order phases: a failed phase does
+    not cancel its dependents. Results come back in declaration order.
+    """
+    _check_acyclic(phases, {p.name for p in phases})
+    with _CHILDREN_LOCK:
+        _CANCELLED.clear()
+    with phase_status("update phases") as status:
+        results = asyncio.run(run_phase_graph_async(phases, max_parallel, status))
+
+    ordered = [results[p.name] for p in phases]
+    path = _critical_path(ordered)
+    if path:
+        total = path[-1].finished_at - path[0].started_at
+        logging.info(
+            f"Critical path ({total:.1f}s): " + " -> ".join(r.name for r in path)
+        )
+    return ordered
+
+
+def _check_acyclic(phases: list[Phase], names: set[str]):
+    deps = {p.name: [d for d in p.deps if d in names] for p in phases}
+    state: dict[str, int] = {}
+
+    def visit(name: str):
+        if state.get(name) == 1:
+            raise ValueError(f"Phase dependency cycle through '{name}'")
+        if state.get(name) == 2:
+            return
+        state[name] = 1
+        for dep in deps[name]:
+            visit(dep)
+        state[name] = 2
+
+    for name in deps:
+        visit(name)
+
+
+def _critical_path(results: list[PhaseResult]) -> list[PhaseResult]:
+    """Walk back from the last phase to finish, each step taking the phase
+    that finished last before the current one started (the dependency or
+    resource holder it was waiting on)."""
+    timed = [r for r in results if r.started_at is not None and r.finished_at is not None]
+    if not timed:
+        return []
+    path = [max(timed, key=lambda r: r.finished_at)]
+    while True:
+        before = [r for r in timed if r.finished_at <= path[-1].started_at + 0.001 and r not in path]
+        if not before:
+            break
+        path.append(max(before, key=lambda r: r.finished_at))
+    return list(reversed(path))
+
+
+def build_phases(
+    include_msstore=True,
+    include_winupdate=True,
+    include_winget=True,
+    include_choco=True,
+    include_health=False,
+    include_cleanup=False,
+    aggressive_cleanup=False,
+    timeout=None,
+    retries=DEFAULT_RETRIES,
+    dry_run=False,
+    phase_timeout=None,
+    winget_jobs=1,
+    prefetch=False,
+) -> list[Phase]:
+    sources = [
+        name for name, wanted in (
+            ("winget", include_winget), ("chocolatey", include_choco),
+            ("store", include_msstore), ("windows_update", include_winupdate),
+        ) if wanted
+    ]
+    phases = [
+        Phase(
+            "preflight", "Checking connectivity",
+            partial(_run_preflight_phase, include_winupdate, sources),
+            resources=("network",),
+        ),
+    ]
+    prefetch = prefetch and include_winupdate
+    if prefetch:
+        # Downloads overlap the package-manager installs; Windows Update
+        # installs once its payloads are local.
+        phases.append(Phase(
+            "prefetch", "Prefetching update payloads",
+            partial(_run_prefetch_phase, timeout, retries, dry_run),
+            deps=("preflight",), resources=("network",),
+        ))
+    if include_choco:
+        phases.append(Phase(
+            "chocolatey", "Updating Chocolatey packages",
+            partial(_run_choco_or_skip, timeout, retries, dry_run),
+            deps=("preflight",), resources=("network", "installer"),
+        ))
+    if include_winget:
+        phases.append(Phase(
+            "winget", "Updating winget packages",
+            partial(_run_winget_phase, include_msstore, timeout, retries, dry_run, winget_jobs),
+            deps=("preflight",), resources=("network", "installer"),
+        ))
+    if include_msstore:
+        phases.append(Phase(
+            "store", "Updating Microsoft Store apps",
+            partial(_run_store_phase, timeout, retries, dry_run),
+            deps=("preflight",), resources=("network",),
+        ))
+    if include_winupdate:
+        phases.append(Phase(
+            "windows_update", "Running Windows Update",
+            partial(_run_winupdate_phase, timeout, retries, dry_run),
+            deps=("preflight", "prefetch") if prefetch else ("preflight",),
+            # Windows Update installs MSI-based updates too (-MicrosoftUpdate),
+            # so it takes every installer slot and never overlaps the package
+            # managers on the Windows Installer mutex (1618).
+            resources=("network", "cbs") + ("installer",) * RESOURCE_LIMITS["installer"],
+        ))
+    if include_health:
+        phases.append(Phase(
+            "health_dism", "Running DISM health check",
+            partial(
+                run_dism_health,
+                timeout=max(timeout or 0, WINUPDATE_TIMEOUT),
+                retries=retries,
+                dry_run=dry_run,
+            ),
+            deps=("windows_update",), resources=("cbs",),
+        ))
+        phases.append(Phase(
+            "health_sfc", "Running SFC scan",
+            partial(
+                run_sfc,
+                timeout=max(timeout or 0, WINUPDATE_TIMEOUT),
+                dry_run=dry_run,
+            ),
+            deps=("health_dism",), resources=("cbs", "disk"),
+        ))
+    if include_cleanup:
+        phases.append(Phase(
+            "cleanup_components", "Cleaning up component store",
+            partial(
+                run_component_cleanup,
+                aggressive=aggressive_cleanup,
+                timeout=max(timeout or 0, CLEANUP_TIMEOUT),
+                dry_run=dry_run,
+            ),
+            deps=("windows_update", "health_sfc"), resources=("cbs", "disk"),
+        ))
+    for phase in phases:
+        phase.timeout = phase_timeout
+    return phases
+
+
+def run_updates(
+    include_msstore=True,
+    include_winupdate=True,
+    include_winget=True,
+    include_choco=True,
+    timeout=None,
+    retries=DEFAULT_RETRIES,
+    dry_run=False,
+    parallel=True,
+    include_health=False,
+    include_cleanup=False,
+    aggressive_cleanup=False,
+    phase_timeout=None,
+    winget_jobs=1,
+    prefetch=False,
+):
+    phases = build_phases(
+        include_msstore=include_msstore,
+        include_winupdate=include_winupdate,
+        include_winget=include_winget,
+        include_choco=include_choco,
+        include_health=include_health,
+        include_cleanup=include_cleanup,
+        aggressive_cleanup=aggressive_cleanup,
+        timeout=timeout,
+        retries=retries,
+        dry_run=dry_run,
+        phase_timeout=phase_timeout,
+        winget_jobs=winget_jobs,
+        prefetch=prefetch,
+    )
+    results = run_phase_graph(phases, max_parallel=None if parallel else 1)
+    if not include_winupdate:
         results.append(
             PhaseResult(
                 "windows_update", True, True, 0, 0.0, details="Skipped by flag"
             )
         )
-
     return results
 
 
 def _print_summary(results: list[PhaseResult], needs_reboot: bool, log_file: str):
     if RICH_AVAILABLE and console is not None:
+        wait_for_logs()
         table = Table(title="Update Summary", show_lines=True)
         table.add_column("Phase", style="bold")
         table.add_column("Status")
@@ -783,6 +2633,16 @@ def parse_args():
         "--skip-winget", action="store_true",
         help="Skip Winget updates.",
     )
+    parser.add_argument(
+        "--winget-jobs", type=int, default=1,
+        help="Upgrade this many winget packages at once, by id (1 = one `winget upgrade --all`). "
+        "MSI-based installers still run one at a time.",
+    )
+    parser.add_argument(
+        "--prefetch", action="store_true",
+        help="Download Windows Updates up front, overlapping the download "
+        "with the package-manager installs.",
+    )
     parser.add_argument(
         "--health", action="store_true",
         help="Run DISM and SFC health checks after updates.",
@@ -807,6 +2667,34 @@ def parse_args():
         "--retries", type=int, default=1,
         help="Retries for networked commands.",
     )
+    parser.add_argument(
+        "--retry-budget", type=int, default=DEFAULT_RETRY_BUDGET,
+        help="Total seconds the run may spend on retries, backoff and waiting for a busy "
+        f"installer (default {DEFAULT_RETRY_BUDGET}, 0 = unlimited).",
+    )
+    parser.add_argument(
+        "--idle-timeout", type=int, default=0,
+        help="Abort a package manager command after this many seconds without output (0 = off). "
+        "Windows Update, DISM and SFC are exempt.",
+    )
+    parser.add_argument(
+        "--fresh-minutes", type=float, default=0,
+        help="Skip winget, Chocolatey and Windows Update if the last run within this many "
+        "minutes left nothing pending and their local indexes are unchanged (0 = always check).",
+    )
+    parser.add_argument(
+        "--capability-cache-hours", type=float, default=0,
+        help="Reuse tool paths, versions and module checks from earlier runs "
+        "for this many hours (0 = probe every run).",
+    )
+    parser.add_argument(
+        "--no-ps-host", action="store_true",
+        help="Start a fresh PowerShell process per snippet instead of reusing sessions.",
+    )
+    parser.add_argument(
+        "--phase-timeout", type=int, default=0,
+        help="Cancel any phase still running after this many seconds (0 = off).",
+    )
     parser.add_argument(
         "--log-level", default="INFO",
         choices=["DEBUG", "INFO", "WARNING", "ERROR"],
@@ -816,13 +2704,23 @@ def parse_args():
         "--summary-json", action="store_true",
         help="Write a JSON summary to the log directory.",
     )
+    parser.add_argument(
+        "--report", nargs="?", type=int, const=REPORT_RUNS, metavar="N",
+        help=f"Print p50/p95 phase durations, failure rates and slowdowns over the "
+        f"last N recorded runs (default {REPORT_RUNS}) and exit.",
+    )
+    parser.add_argument(
+        "--trace", choices=["chrome", "otel"],
+        help="Write per-phase, per-command and backoff timing spans to the log directory "
+        "as a Chrome trace (chrome://tracing, Perfetto) or OTel-style JSONL.",
+    )
     parser.add_argument(
         "--dry-run", action="store_true",
         help="Show what would be updated without making changes.",
     )
     parser.add_argument(
         "--no-parallel", action="store_true",
-        help="Disable parallel execution of winget and Chocolatey updates.",
+        help="Run update phases one at a time instead of overlapping independent ones.",
     )
     return parser.parse_args()
 
@@ -831,6 +2729,11 @@ def main():
     args = parse_args()
 
     log_file = setup_logging(level=getattr(logging, args.log_level))
+    history = RunHistory(os.path.join(_log_dir(), "run_history.jsonl"))
+
+    if args.report is not None:
+        _print_report(history, max(1, args.report))
+        return
 
     dry_run = args.dry_run
     if dry_run:
@@ -853,9 +2756,22 @@ def main():
         return (phase in only_raw) if only_raw else default
 
     timeout = args.timeout if args.timeout > 0 else None
-    global DEFAULT_TIMEOUT, DEFAULT_RETRIES
+    global DEFAULT_TIMEOUT, DEFAULT_IDLE_TIMEOUT, DEFAULT_RETRIES
     DEFAULT_TIMEOUT = timeout
+    DEFAULT_IDLE_TIMEOUT = args.idle_timeout if args.idle_timeout > 0 else None
     DEFAULT_RETRIES = max(1, args.retries)
+    RETRY_BUDGET.configure(args.retry_budget)
+    if args.capability_cache_hours > 0:
+        CAPABILITIES.configure(
+            os.path.join(_log_dir(), "capabilities.json"),
+            args.capability_cache_hours * 3600,
+        )
+    UPDATE_STATE.configure(
+        os.path.join(_log_dir(), "update_state.json"), args.fresh_minutes * 60
+    )
+    global POWERSHELL_POOL
+    if not args.no_ps_host:
+        POWERSHELL_POOL = PowerShellPool()
 
     include_msstore = want("store", default=not args.skip_store)
     include_winupdate = want("winupdate", default=not args.skip_winupdate)
@@ -863,47 +2779,37 @@ def main():
     include_choco = want("choco", default=not args.skip_choco)
     parallel = not args.no_parallel
 
-    results = run_updates(
-        include_msstore=include_msstore,
-        include_winupdate=include_winupdate,
-        include_winget=include_winget,
-        include_choco=include_choco,
-        timeout=timeout,
-        retries=DEFAULT_RETRIES,
-        dry_run=dry_run,
-        parallel=parallel,
-    )
-
-    if want("health", default=args.health):
-        with phase_status("Running DISM health check"):
-            results.append(
-                run_dism_health(
-                    timeout=max(timeout or 0, WINUPDATE_TIMEOUT),
-                    retries=DEFAULT_RETRIES,
-                    dry_run=dry_run,
-                )
-            )
-        with phase_status("Running SFC scan"):
-            results.append(
-                run_sfc(
-                    timeout=max(timeout or 0, WINUPDATE_TIMEOUT),
-                    dry_run=dry_run,
-                )
-            )
-
-    if want("cleanup", default=args.cleanup):
-        with phase_status("Cleaning up component store"):
-            results.append(
-                run_component_cleanup(
-                    aggressive=args.aggressive_cleanup,
-                    timeout=max(timeout or 0, CLEANUP_TIMEOUT),
-                    dry_run=dry_run,
-                )
-            )
+    try:
+        results = run_updates(
+            include_msstore=include_msstore,
+            include_winupdate=include_winupdate,
+            include_winget=include_winget,
+            include_choco=include_choco,
+            timeout=timeout,
+            retries=DEFAULT_RETRIES,
+            dry_run=dry_run,
+            parallel=parallel,
+            include_health=want("health", default=args.health),
+            include_cleanup=want("cleanup", default=args.cleanup),
+            aggressive_cleanup=args.aggressive_cleanup,
+            phase_timeout=args.phase_timeout if args.phase_timeout > 0 else None,
+            winget_jobs=max(1, args.winget_jobs),
+            prefetch=args.prefetch,
+        )
 
-    needs_reboot = check_reboot_required()
+        needs_reboot = check_reboot_required()
+    finally:
+        if POWERSHELL_POOL is not None:
+            POWERSHELL_POOL.close()
+        # Earlier versions kept downloaded .nupkg files here; nothing
+        # writes to it any more.
+        shutil.rmtree(os.path.join(_log_dir(), "cache", "choco"), ignore_errors=True)
+        CAPABILITIES.save()
+        UPDATE_STATE.save()
 
     _print_summary(results, needs_reboot, log_file)
+    if not dry_run:
+        history.append(results, needs_reboot)
 
     if needs_reboot and args.reboot and not dry_run:
         logging.info("Reboot required and --reboot specified. Rebooting now...")
@@ -935,18 +2841,31 @@ def main():
         "results": [asdict(r) for r in results],
         "finished_at": datetime.now().isoformat(),
     }
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     if args.summary_json:
         try:
-            out_path = os.path.join(
-                _log_dir(),
-                f"summary_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
-            )
+            out_path = os.path.join(_log_dir(), f"summary_{stamp}.json")
             with open(out_path, "w", encoding="utf-8") as f:
                 json.dump(summary, f, indent=2)
             logging.info(f"Summary JSON: {out_path}")
         except Exception as e:
             logging.warning(f"Failed to write summary JSON: {e}")
+    if args.trace:
+        try:
+            if args.trace == "chrome":
+                out_path = os.path.join(_log_dir(), f"trace_{stamp}.json")
+                TRACER.export_chrome(out_path)
+            else:
+                out_path = os.path.join(_log_dir(), f"trace_{stamp}.jsonl")
+                TRACER.export_jsonl(out_path)
+            logging.info(f"Trace ({len(TRACER.spans)} spans): {out_path}")
+        except Exception as e:
+            logging.warning(f"Failed to write trace: {e}")
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    except KeyboardInterrupt:
+        logging.warning("Interrupted; running child processes were stopped.")
+        sys.exit(130)